@@ -0,0 +1,69 @@
+'''Import Time Benchmark
+
+Description:
+Measures how long a fresh interpreter takes to import brotherprint, using the
+interpreter's own -X importtime report, and checks that the ESC/P and template command
+path does not load numpy or the optional image and barcode encoders. Exits with status
+1 if the median import time is over budget or a heavy module was loaded.
+
+Usage:
+    python benchmarks/import_time.py [--budget 50] [--runs 20]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Let the warm up run write bytecode, so later runs measure a cached import.
+ENV = dict((k, v) for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE')
+
+# Modules the core command path must not import.
+heavy = ('numpy', 'PIL', 'qrcode', 'pdf417gen', 'pylibdmtx', 'http.server')
+
+CHECK = ('import sys, brotherprint; brotherprint.BrotherPrint; '
+         'print(",".join(m for m in %r if m in sys.modules))' % (heavy,))
+
+
+def import_time():
+    # Cumulative microseconds of the top level brotherprint import in a new interpreter.
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import brotherprint'],
+                            cwd=ROOT, env=ENV, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    for line in result.stderr.splitlines():
+        if line.rstrip().endswith('| brotherprint'):
+            return int(line.split('|')[1])
+    raise RuntimeError('brotherprint missing from the import time report.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Guard the brotherprint import time.')
+    parser.add_argument('--budget', type=float, default=50.0, help='milliseconds')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    # Warm up once so bytecode compilation and a cold disk cache are not measured.
+    import_time()
+    times = sorted(import_time() / 1000.0 for _ in range(args.runs))
+    median = statistics.median(times)
+    print('import brotherprint: median %.1f ms, min %.1f ms, max %.1f ms over %d runs'
+          % (median, times[0], times[-1], args.runs))
+
+    loaded = subprocess.run([sys.executable, '-c', CHECK], cwd=ROOT, env=ENV,
+                            stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout.strip()
+    failed = False
+    if loaded:
+        print('heavy modules loaded by the core import: %s' % loaded)
+        failed = True
+    if median > args.budget:
+        print('over the %.0f ms budget' % args.budget)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
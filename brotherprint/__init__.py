@@ -1 +1,36 @@
-from brotherprint import BrotherPrint
\ No newline at end of file
+from .brotherprint import BrotherPrint
+
+import importlib
+
+# The raster, image and 2D barcode subsystems need numpy and optional encoders. They are
+# imported on first use, so the ESC/P and template command path starts quickly.
+_submodules = ('barcode2d', 'bitimage', 'cache', 'coalesce', 'composer', 'decoder',
+               'discovery', 'gateway', 'image', 'jobqueue', 'raster', 'replay', 'service',
+               'stream', 'transport')
+
+_names = {'RasterJob': 'raster',
+          'LabelComposer': 'composer',
+          'preprocess': 'image',
+          'Decoder': 'decoder',
+          'decode': 'decoder',
+          'PrintQueue': 'jobqueue',
+          'Coalescer': 'coalesce',
+          'Gateway': 'gateway',
+          'discover': 'discovery',
+          'SocketTransport': 'transport',
+          'DeviceTransport': 'transport',
+          'MemoryTransport': 'transport'}
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name in _names:
+        value = getattr(importlib.import_module('.' + _names[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules) | set(_names))
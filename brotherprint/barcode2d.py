@@ -0,0 +1,134 @@
+'''2D Barcode Support
+
+Description:
+Raster fallback for the 2D barcodes of BrotherPrint.barcode_2d, for models and modes
+without the native QR Code, PDF417 and DataMatrix commands.
+
+The fallback encodes the symbol into a matrix of modules (True = dark) with
+the qrcode, pdf417gen and pylibdmtx packages, which are only imported when a symbol
+of that type is first needed. Encoding is by far the slowest part of a 2D label, so
+matrices are kept in an LRU cache keyed by symbology, data and encoding options.
+'''
+import numpy
+
+from .cache import LRUCache
+
+
+error_corrections = ('L', 'M', 'Q', 'H')
+
+symbol_cache = LRUCache(256)
+
+
+def _qr_matrix(data, error_correction, model):
+    import qrcode
+    levels = {'L': qrcode.constants.ERROR_CORRECT_L,
+              'M': qrcode.constants.ERROR_CORRECT_M,
+              'Q': qrcode.constants.ERROR_CORRECT_Q,
+              'H': qrcode.constants.ERROR_CORRECT_H}
+    if model != 'model2':
+        raise RuntimeError('No raster encoder for qr %s.' % model)
+    symbol = qrcode.QRCode(error_correction=levels[error_correction], border=0)
+    symbol.add_data(data)
+    symbol.make(fit=True)
+    return numpy.array(symbol.get_matrix(), dtype=numpy.bool_)
+
+
+def _pdf417_matrix(data, columns, security_level):
+    import pdf417gen
+    if columns:
+        codes = pdf417gen.encode(data, columns=columns, security_level=security_level)
+    else:
+        # Short data needs fewer columns to reach the minimum of 3 rows.
+        for columns in range(6, 0, -1):
+            try:
+                codes = pdf417gen.encode(data, columns=columns, security_level=security_level)
+                break
+            except ValueError:
+                if columns == 1:
+                    raise
+    image = pdf417gen.render_image(codes, scale=1, ratio=1, padding=0)
+    return numpy.asarray(image.convert('L')) < 128
+
+
+def _datamatrix_matrix(data, rows, columns, rectangular):
+    from pylibdmtx.pylibdmtx import encode
+    size = None
+    if rows and columns:
+        size = '%dx%d' % (rows, columns)
+    elif rectangular:
+        size = 'RectAuto'
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    encoded = encode(data, size=size)
+    pixels = numpy.frombuffer(encoded.pixels, dtype=numpy.uint8)
+    pixels = pixels.reshape(encoded.height, encoded.width, encoded.bpp // 8)
+    dark = pixels[:, :, :3].mean(axis=2) < 128
+    # Strip the quiet zone, then sample once per module. The top edge of the
+    # symbol alternates dark and light, so its first run is one module wide.
+    ys = numpy.flatnonzero(dark.any(axis=1))
+    xs = numpy.flatnonzero(dark.any(axis=0))
+    dark = dark[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+    light = numpy.flatnonzero(~dark[0])
+    module = light[0] if len(light) else 1
+    return dark[module // 2::module, module // 2::module]
+
+
+def symbol_matrix(data, format, error_correction='M', model='model2', columns=0, rows=0,
+                  security_level=2, rectangular=False):
+    '''Encode a 2D symbol into a matrix of modules, using the symbol cache.
+
+    Args:
+        data: the barcode data.
+        format: 'qr', 'pdf417' or 'datamatrix'.
+        error_correction, model, columns, rows, security_level, rectangular: see
+            BrotherPrint.barcode_2d.
+    Returns:
+        A read only 2D numpy bool array, True for dark modules. It is shared with
+        the cache and must not be modified.
+    Raises:
+        RuntimeError: Invalid parameters.
+        RuntimeError: No raster encoder for the format.
+        ImportError: The encoder package for the format is not installed.
+    '''
+    if format == 'qr':
+        if error_correction not in error_corrections:
+            raise RuntimeError('Invalid parameters')
+        options = (error_correction, model)
+        encode = lambda: _qr_matrix(data, error_correction, model)
+    elif format == 'pdf417':
+        options = (columns, security_level)
+        encode = lambda: _pdf417_matrix(data, columns, security_level)
+    elif format == 'datamatrix':
+        options = (rows, columns, rectangular)
+        encode = lambda: _datamatrix_matrix(data, rows, columns, rectangular)
+    elif format == 'maxicode':
+        raise RuntimeError('No raster encoder for maxicode.')
+    else:
+        raise RuntimeError('Invalid parameters')
+
+    def build():
+        matrix = encode()
+        matrix.setflags(write=False)
+        return matrix
+    return symbol_cache.get_or_create((format, data, options), build)
+
+
+def render(matrix, cell_size=4, quiet_zone=0, row_height=None):
+    '''Scale a module matrix up to printer dots.
+
+    Args:
+        matrix: 2D bool array of modules.
+        cell_size: dots per module, horizontally.
+        quiet_zone: blank modules added on every side.
+        row_height: dots per module row, defaults to cell_size. PDF417 rows are
+            normally three times as tall as wide.
+    Returns:
+        A 2D numpy bool array, True where a dot is printed.
+    Raises:
+        None
+    '''
+    if row_height is None:
+        row_height = cell_size
+    if quiet_zone:
+        matrix = numpy.pad(matrix, quiet_zone, mode='constant', constant_values=False)
+    return numpy.repeat(numpy.repeat(matrix, row_height, axis=0), cell_size, axis=1)
@@ -0,0 +1,112 @@
+'''ESC/P Bit Image Packing
+
+Description:
+Converts NumPy arrays and PIL images into ESC * bit image commands. ESC/P wants the
+image in horizontal bands of 8 or 24 dots, each band sent column by column with the
+top dot in the most significant bit. The packing is done for the whole image at once
+with a reshape, a transpose and numpy.packbits, and packed images are kept in an LRU
+cache so a logo printed on every label is only packed once.
+'''
+import numpy
+
+from .cache import LRUCache, fingerprint
+
+
+densities = {'8-dot single': 0,
+             '8-dot double': 1,
+             '24-dot single': 32,
+             '24-dot double': 33}
+
+bit_image_cache = LRUCache(64)
+
+
+def to_bitmap(image):
+    '''Convert an image to a 2D boolean array, True where a dot is printed.
+
+    Args:
+        image: a PIL image, or a NumPy array. Boolean arrays are used as is, other
+            arrays are greyscale with values below 128 printed. RGB(A) arrays are
+            averaged to grey first.
+    Returns:
+        A 2D numpy bool array of shape (height, width).
+    Raises:
+        RuntimeError: Unsupported image.
+    '''
+    if hasattr(image, 'convert') and hasattr(image, 'mode'):
+        image = numpy.asarray(image.convert('L'))
+    image = numpy.asarray(image)
+    if image.dtype == numpy.bool_ and image.ndim == 2:
+        return image
+    if image.ndim == 3:
+        image = image[:, :, :3].mean(axis=2)
+    if image.ndim != 2:
+        raise RuntimeError('Unsupported image.')
+    return image < 128
+
+
+def pack_columns(bitmap, rows):
+    '''Pack a bitmap into bands of column-major bytes.
+
+    Args:
+        bitmap: 2D bool array, True where a dot is printed.
+        rows: dots per band, 8 or 24.
+    Returns:
+        List of bytes, one entry per band, each holding rows/8 bytes per column.
+    Raises:
+        None
+    '''
+    height, width = bitmap.shape
+    bands = -(-height // rows)
+    if bands * rows != height:
+        padded = numpy.zeros((bands * rows, width), dtype=numpy.bool_)
+        padded[:height] = bitmap
+        bitmap = padded
+    # (band, byte in column, bit, column) -> (band, column, byte in column, bit)
+    bits = bitmap.reshape(bands, rows // 8, 8, width).transpose(0, 3, 1, 2)
+    packed = numpy.packbits(bits, axis=-1)
+    return [band.tobytes() for band in packed]
+
+
+def compile_bit_image(image, density='24-dot double', band_feed=None, key=None):
+    '''Build the ESC * command stream that prints an image.
+
+    Args:
+        image: a PIL image or NumPy array, see to_bitmap.
+        density: '8-dot single', '8-dot double', '24-dot single' or '24-dot double'.
+        band_feed: forward feed after each band, in the units of ESC J, 0 to 255.
+            Defaults to the band height in dots.
+        key: optional cache key, e.g. a logo name, saving the cost of hashing the
+            image on every call.
+    Returns:
+        The commands as a str of byte values, ready for BrotherPrint.send.
+    Raises:
+        RuntimeError: Invalid density.
+        RuntimeError: Invalid band feed.
+        RuntimeError: Image too wide.
+    '''
+    if density not in densities:
+        raise RuntimeError('Invalid density.')
+    m = densities[density]
+    rows = 24 if m >= 32 else 8
+    if band_feed is None:
+        band_feed = rows
+    if not 0 <= band_feed <= 255:
+        raise RuntimeError('Invalid band feed, must be less than 256 and >= 0.')
+    bitmap = None
+    if key is None:
+        bitmap = to_bitmap(image)
+        key = fingerprint(bitmap)
+    cache_key = (key, m, band_feed)
+    compiled = bit_image_cache.get(cache_key)
+    if compiled is not None:
+        return compiled
+    if bitmap is None:
+        bitmap = to_bitmap(image)
+    width = bitmap.shape[1]
+    if width > 0xffff:
+        raise RuntimeError('Image too wide.')
+    header = chr(27)+'*'+chr(m)+chr(width%256)+chr(width//256)
+    feed = chr(13)+chr(27)+'J'+chr(band_feed)
+    compiled = feed.join(header+band.decode('latin-1') for band in pack_columns(bitmap, rows)) + feed
+    bit_image_cache.put(cache_key, compiled)
+    return compiled
@@ -1,4 +1,4 @@
-import re
+from .transport import as_transport
 '''Brother Python EscP Command Library
 
 Description:
@@ -12,10 +12,16 @@ class BrotherPrint:
     
     font_types = {'bitmap': 0,
                   'outline': 1}
+
+    # Most bytes of one label kept for printing copies from one buffer.
+    label_limit = 1 << 20
     
     def __init__(self, fsocket):
         self.fsocket = fsocket
+        self.transport = as_transport(fsocket)
         self.fonttype = self.font_types['bitmap']
+        self.label = []
+        self.label_size = 0
     
     ###########################################################################
     # System Commands & Settings
@@ -143,8 +149,20 @@ class BrotherPrint:
             self.send(chr(27)+'iC'+chr(cut_settings[cut]))
         else:
             raise RuntimeError('Invalid cut type.')
-        
-        
+
+    def status_request(self):
+        '''Ask the printer to send back its 32 byte status information.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        self.send(chr(27)+'iS')
+
+
     ###########################################################################
     # Format Commands
     ###########################################################################
@@ -178,6 +196,7 @@ class BrotherPrint:
         Raises:
             None
         '''
+        import re
         n = None
         if amount=='1/8':
             amount = '0'
@@ -206,7 +225,7 @@ class BrotherPrint:
         Raises:
             RuntimeError: Length must be less than 12000.
         '''
-        mH = length/256
+        mH = length//256
         mL = length%256
         if length < 12000:
             self.send(chr(27)+'('+'C'+chr(2)+chr(0)+chr(mL)+chr(mH))
@@ -225,9 +244,9 @@ class BrotherPrint:
             RuntimeError: Top margin must be less than the bottom margin.
         '''
         tL = topmargin%256
-        tH = topmargin/256
+        tH = topmargin//256
         BL = bottommargin%256
-        BH = topmargin/256
+        BH = topmargin//256
         if (tL+tH*256) < (BL + BH*256):
             self.send(chr(27)+'('+'c'+chr(4)+chr(0)+chr(tL)+chr(tH)+chr(BL)+chr(BH))
         else:
@@ -324,8 +343,79 @@ class BrotherPrint:
             None
         Raises:
             None'''
-        self.fsocket.send(text)
-        
+        if self.label is not None:
+            # Kept until the label ends, for printing copies. Labels over the limit,
+            # or streams never ending a page, stop being kept.
+            self.label_size += len(text)
+            if self.label_size > self.label_limit:
+                self.label = None
+            else:
+                self.label.append(text)
+        self.transport.send(text)
+
+    def _take_label(self):
+        # Everything sent since the last label ended, as one buffer for repeat printing,
+        # or None if it was over the limit.
+        label, self.label, self.label_size = self.label, [], 0
+        if label is None:
+            return None
+        return b''.join([part.encode('latin-1') if isinstance(part, str) else part for part in label])
+
+    def _check_copies(self, copies, repeat_over=None):
+        # Copies over repeat_over are printed by resending the label buffer.
+        if isinstance(copies, bool) or not isinstance(copies, int) or copies < 1:
+            raise RuntimeError('Invalid copies.')
+        if repeat_over is not None and copies > repeat_over and self.label is None:
+            raise RuntimeError('Label too large to repeat.')
+
+    def flush(self):
+        '''Write out anything the transport is still buffering. Called at the end of every label.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        if hasattr(self.transport, 'flush'):
+            self.transport.flush()
+
+    def print_raster(self, job, copies=1):
+        '''Send a raster job. The job switches the printer to raster mode itself.
+
+        Args:
+            job: a RasterJob or LabelComposer.
+            copies: number of times to print the job. Each page is encoded once and
+            the same buffer is sent for every copy.
+        Returns:
+            None
+        Raises:
+            RuntimeError: The job has no pages.
+            RuntimeError: Invalid copies.
+        '''
+        self._check_copies(copies)
+        for chunk in job.chunks(copies, getattr(self.transport, 'throughput', None)):
+            self.transport.send(chunk)
+        self._take_label()
+        self.flush()
+
+    def stream_raster(self, job, source):
+        '''Send a single page raster job as its rows are read, for very long labels.
+
+        Args:
+            job: a RasterJob holding the print settings.
+            source: row source, see brotherprint.stream.
+        Returns:
+            None
+        Raises:
+            RuntimeError: The source row count does not match its height.
+        '''
+        for chunk in job.stream(source, getattr(self.transport, 'throughput', None)):
+            self.transport.send(chunk)
+        self._take_label()
+        self.flush()
+
     def forward_feed(self, amount):
         '''Calling this function finishes input of the current line, then moves the vertical 
         print position forward by x/300 inch.
@@ -354,7 +444,7 @@ class BrotherPrint:
             RuntimeError: Invalid vertical position.
         '''
         mL = amount%256
-        mH = amount/256
+        mH = amount//256
         if amount < 32767 and amount > 0:
             self.send(chr(27)+'('+'V'+chr(2)+chr(0)+chr(mL)+chr(mH))
         else:
@@ -373,7 +463,7 @@ class BrotherPrint:
             None
         '''
         n1 = amount%256
-        n2 = amount/256
+        n2 = amount//256
         self.send(chr(27)+'${n1}{n2}'.format(n1=chr(n1), n2=chr(n2)))
     
     def rel_horz_pos(self, amount):
@@ -391,7 +481,7 @@ class BrotherPrint:
             None
         '''
         n1 = amount%256
-        n2 = amount/256
+        n2 = amount//256
         self.send(chr(27)+'\{n1}{n2}'.format(n1=chr(n1),n2=chr(n2)))
 
     def alignment(self, align):
@@ -454,19 +544,32 @@ class BrotherPrint:
             None
         '''
         self.send(chr(12))
+        self._take_label()
         
-    def print_page(self, cut):
+    def print_page(self, cut, copies=1):
         '''End input, set cut setting, and pagefeed.
-        
+
         Args:
             cut: cut setting, choose from 'full', 'half', 'special' and 'chain'
+            copies: number of times to print the page. ESC/P has no copy count, so
+            everything sent since the last page is replayed from one buffer.
         Returns:
             None
         Raises:
-            None
+            RuntimeError: Invalid copies.
+            RuntimeError: Label too large to repeat.
         '''
+        self._check_copies(copies, repeat_over=1)
         self.cut_setting(cut)
+        label = self._take_label()
         self.page_feed()
+        if copies > 1:
+            if label is None:
+                raise RuntimeError('Label too large to repeat.')
+            label += b'\x0c'
+        for _ in range(copies - 1):
+            self.transport.send(label)
+        self.flush()
         
     def frame(self, action):
         '''Places/removes frame around text
@@ -801,11 +904,24 @@ class BrotherPrint:
     # Bit Image
     ############################################################################
     
-    # TODO: Complete bit image methods
-    
-        
-        
-        
+    def bit_image(self, image, density='24-dot double', band_feed=None, key=None):
+        '''Print an image as ESC/P bit image graphics.
+
+        Args:
+            image: a PIL image or a NumPy array. Boolean arrays print True dots, other
+            arrays are greyscale with values below 128 printed.
+            density: Choose from '8-dot single', '8-dot double', '24-dot single' and '24-dot double'
+            band_feed: forward feed after each 8 or 24 dot band. Defaults to the band height.
+            key: optional cache key for images reused across labels, such as a logo name.
+        Returns:
+            None
+        Raises:
+            RuntimeError: Invalid density.
+            RuntimeError: Image too wide.
+        '''
+        from .bitimage import compile_bit_image
+        self.send(compile_bit_image(image, density, band_feed, key))
+
     ############################################################################
     # Barcode 
     ############################################################################
@@ -861,7 +977,7 @@ class BrotherPrint:
                             'on': '1'}
         
         sendstr = ''
-        n2 = height/256
+        n2 = height//256
         n1 = height%256
         if format in barcodes and width in widths and ratio in ratios and characters in character_choices and rss_symbol in rss_symbols:
             sendstr += (chr(27)+'i'+'t'+barcodes[format]+'s'+'p'+'r'+character_choices[characters]+'u'+'x'+'y'+'h' + chr(n1) + chr(n2) +
@@ -872,22 +988,106 @@ class BrotherPrint:
             self.send(sendstr)
         else:
             raise RuntimeError('Invalid parameters')
-        
+
+    def barcode_2d(self, data, format, method='native', cell_size=4, error_correction='M', model='model2', columns=0, rows=0, security_level=2, rectangular=False, mode=2, quiet_zone=0):
+        '''Print a 2D barcode
+
+        Args:
+            data: the barcode data
+            format: the barcode type you want. Choose between qr, pdf417, datamatrix, maxicode
+            method: 'native' uses the printer's 2D barcode commands, 'raster' encodes the symbol here and prints it as a bit image. maxicode is native only.
+            cell_size: module size, in dots. Choose 3, 4, 5, 6, 8 or 10 for native qr.
+            error_correction: qr error correction level. Choose 'L', 'M', 'Q', 'H'
+            model: qr model. Choose 'model1', 'model2', 'micro'. Raster only supports model2.
+            columns: pdf417 data columns or datamatrix symbol columns, 0 for automatic.
+            rows: pdf417 rows or datamatrix symbol rows, 0 for automatic.
+            security_level: pdf417 error correction level, 0 to 8.
+            rectangular: datamatrix rectangular symbol instead of square.
+            mode: maxicode mode, 2 to 6.
+            quiet_zone: blank modules around a raster symbol.
+        Returns:
+            None
+        Raises:
+            RuntimeError: Invalid parameters
+            RuntimeError: No raster encoder for the format.
+        '''
+        formats = {'qr': 'Q',
+                   'pdf417': 'V',
+                   'datamatrix': 'D',
+                   'maxicode': 'U'}
+
+        error_corrections = {'L': 1,
+                             'M': 2,
+                             'Q': 3,
+                             'H': 4}
+
+        models = {'model1': 1,
+                  'model2': 2,
+                  'micro': 3}
+
+        qr_cell_sizes = (3, 4, 5, 6, 8, 10)
+
+        if (format not in formats or method not in ('native', 'raster') or error_correction not in error_corrections
+                or model not in models or not 1 <= cell_size <= 255 or not 0 <= security_level <= 8
+                or not 0 <= columns <= 144 or not 0 <= rows <= 144 or not 2 <= mode <= 6
+                or (format == 'qr' and method == 'native' and cell_size not in qr_cell_sizes)):
+            raise RuntimeError('Invalid parameters')
+
+        if method == 'raster':
+            from .barcode2d import symbol_matrix, render
+            matrix = symbol_matrix(data, format, error_correction, model, columns, rows, security_level, rectangular)
+            row_height = cell_size*3 if format == 'pdf417' else cell_size
+            key = ('barcode_2d', format, data, error_correction, model, columns, rows, security_level, rectangular, cell_size, quiet_zone)
+            self.bit_image(render(matrix, cell_size, quiet_zone, row_height), key=key)
+            return
+
+        sendstr = chr(27)+'i'+formats[format]
+        if format == 'qr':
+            # cell size, model, structured append (unused), error correction, automatic data input
+            sendstr += chr(cell_size)+chr(models[model])+chr(0)*4+chr(error_corrections[error_correction])+chr(0)
+        elif format == 'pdf417':
+            sendstr += chr(0)+chr(cell_size)+chr(security_level)+chr(columns)+chr(rows)
+        elif format == 'datamatrix':
+            sendstr += chr(1 if rectangular else 0)+chr(cell_size)+chr(rows)+chr(columns)
+        else:
+            sendstr += chr(mode)
+        self.send(sendstr + data + chr(92)*3)
+
     ############################################################################
     # Template Commands
     ############################################################################
     
-    def template_print(self):
+    def template_print(self, copies=None):
         '''Print the page
-        
+
         Args:
-            None
+            copies: number of copies, sent as the printer's own copy count (^CN).
+            Counts over 999 resend the template and fields for each run of 999.
+            None sends no count, so the printer's or template's setting applies.
         Returns:
             None
         Raises:
-            None
+            RuntimeError: Invalid copies.
+            RuntimeError: Label too large to repeat.
         '''
-        self.send('^FF')
+        if copies is None:
+            self.send('^FF')
+            self._take_label()
+            self.flush()
+            return
+        self._check_copies(copies, repeat_over=999)
+        label = self._take_label()
+        first = True
+        while copies:
+            count = min(copies, 999)
+            copies -= count
+            if not first:
+                self.transport.send(label)
+            # The printer keeps the copy count, so every label sets its own, and
+            # nothing follows the ^FF that ends it.
+            self.transport.send('^CN%03d^FF' % count)
+            first = False
+        self.flush()
     
     def choose_template(self, template):
         '''Choose a template
@@ -899,7 +1099,7 @@ class BrotherPrint:
         Raises:
             None
         '''
-        n1 = int(template)/10
+        n1 = int(template)//10
         n2 = int(template)%10
         self.send('^TS'+'0'+str(n1)+str(n2))
         
@@ -967,7 +1167,7 @@ class BrotherPrint:
         size = len(command)
         if size > 20:
             raise RuntimeError('Command too long')
-        n1 = size/10
+        n1 = size//10
         n2 = size%10
         self.send('^PS'+chr(n1)+chr(n2)+command)
     
@@ -981,8 +1181,8 @@ class BrotherPrint:
         Raises:
             None
         '''
-        n1 = count/100
-        n2 = (count-(n1*100))/10
+        n1 = count//100
+        n2 = (count-(n1*100))//10
         n3 = (count-((n1*100)+(n2*10)))
         self.send('^PC'+chr(n1)+chr(n2)+chr(n3))
         
@@ -999,7 +1199,7 @@ class BrotherPrint:
         size = len(delim)
         if size > 20:
             raise RuntimeError('Delimeter too long')
-        n1 = size/10
+        n1 = size//10
         n2 = size%10
         self.send('^SS'+chr(n1)+chr(n2))
         
@@ -1029,7 +1229,7 @@ class BrotherPrint:
             data = ''
         size = len(data)
         n1 = size%256
-        n2 = size/256
+        n2 = size//256
             
         self.send('^DI'+chr(n1)+chr(n2)+data)
     
@@ -0,0 +1,130 @@
+'''Caching Helpers
+
+Description:
+A small thread safe LRU cache and a content fingerprint used to key it. Packed logos,
+encoded barcode symbols and preprocessed images are expensive to build and are usually
+the same from one label to the next, so they are kept here between labels.
+'''
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def fingerprint(*parts):
+    '''Build a hashable key from the content of the given parts.
+
+    Args:
+        parts: any mix of bytes, str, numbers, tuples and NumPy arrays. Arrays are
+            keyed by their shape, dtype and data rather than their identity.
+    Returns:
+        A hex digest string.
+    Raises:
+        None
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if hasattr(part, 'tobytes') and hasattr(part, 'shape'):
+            digest.update(repr((part.shape, str(part.dtype))).encode('ascii'))
+            part = part.tobytes()
+        elif isinstance(part, str):
+            part = part.encode('utf-8')
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode('utf-8')
+        digest.update(b'%d:' % len(part))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    '''Least recently used cache with a fixed number of entries.
+
+    Attributes:
+        maxsize: the number of entries kept.
+        hits: number of lookups that found an entry.
+        misses: number of lookups that did not.
+    '''
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        '''Look up an entry, marking it as recently used.
+
+        Args:
+            key: the entry key.
+            default: returned when the key is not cached.
+        Returns:
+            The cached value or default.
+        Raises:
+            None
+        '''
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''Store an entry, evicting the least recently used one if full.
+
+        Args:
+            key: the entry key.
+            value: the value to cache.
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        '''Return the cached value for key, building and storing it if missing.
+
+        Args:
+            key: the entry key.
+            factory: called with no arguments to build a missing value. It runs
+                outside the cache lock.
+        Returns:
+            The cached or newly built value.
+        Raises:
+            Whatever factory raises.
+        '''
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        '''Drop every entry and reset the counters.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,202 @@
+'''Duplicate Job Coalescing
+
+Description:
+Stations often ask for the same label several times at once (retries, double clicks).
+The Coalescer fingerprints each job description so concurrent identical requests wait
+for a single encoding and share its bytes, and recent encodings are kept for reuse.
+
+With a dedupe window set, a job identical to one submitted within the last window
+seconds is treated as an accidental duplicate and not printed again. A job that fails
+to print is forgotten, so retrying it prints. Jobs that give an explicit copy count are
+always printed that many times.
+
+A job description is a list of BrotherPrint calls, e.g.
+    [('template_mode',), ('template_init',), ('choose_template', '3'),
+     ('select_and_insert', 'name', 'Bob'), ('template_print',)]
+or anything else a custom compile function understands and json can serialize.
+
+Copies given to print_job replay the one cached buffer. Printers that count copies
+themselves are better served by putting the count in the job description, e.g.
+('template_print', 5), so the payload is sent once.
+'''
+import json
+import threading
+import time
+
+from .brotherprint import BrotherPrint
+from .cache import LRUCache, fingerprint
+from .transport import MemoryTransport
+
+
+def job_fingerprint(spec):
+    '''Fingerprint a job description.
+
+    Args:
+        spec: the job description. Dict key order does not matter.
+    Returns:
+        A hex digest string.
+    Raises:
+        None
+    '''
+    return fingerprint(json.dumps(spec, sort_keys=True, default=repr))
+
+
+def compile_commands(spec):
+    '''Compile a list of BrotherPrint calls.
+
+    Args:
+        spec: list of (method name, arg, ...) tuples.
+    Returns:
+        The bytes the calls send.
+    Raises:
+        RuntimeError: Unknown command.
+        RuntimeError: Whatever the called methods raise for invalid parameters.
+    '''
+    buf = MemoryTransport()
+    job = BrotherPrint(buf)
+    for call in spec:
+        name, args = call[0], call[1:]
+        method = getattr(job, name, None)
+        if name.startswith('_') or name in ('send', 'flush') or not callable(method):
+            raise RuntimeError('Unknown command.')
+        method(*args)
+    return buf.getvalue()
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.error = None
+
+
+class Coalescer:
+    '''Shares encodings between identical jobs and optionally drops duplicates.
+
+    Attributes:
+        window: dedupe window in seconds, 0 to print every request.
+        encoded: LRUCache of recent encodings by fingerprint.
+        suppressed: number of duplicate requests not printed.
+    '''
+
+    def __init__(self, send=None, compile=compile_commands, window=0, cache_size=256):
+        '''Set up a coalescer.
+
+        Args:
+            send: called with the payload bytes for each copy printed, e.g. the send
+            method of a transport. Only needed for print_job.
+            compile: turns a job description into bytes.
+            window: dedupe window in seconds.
+            cache_size: number of recent encodings kept.
+        Raises:
+            None
+        '''
+        self.send = send
+        self.compile = compile
+        self.window = window
+        self.encoded = LRUCache(cache_size)
+        self.suppressed = 0
+        self._flights = {}
+        self._printed = {}
+        self._lock = threading.Lock()
+
+    def encode(self, spec):
+        '''Compile a job, sharing the work with identical concurrent and recent jobs.
+
+        Args:
+            spec: the job description.
+        Returns:
+            A (fingerprint, payload) tuple.
+        Raises:
+            Whatever compile raises, in every caller waiting on the encoding.
+        '''
+        key = job_fingerprint(spec)
+        payload = self.encoded.get(key)
+        if payload is not None:
+            return key, payload
+        with self._lock:
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = _Flight()
+        if owner:
+            try:
+                flight.payload = self.compile(spec)
+                self.encoded.put(key, flight.payload)
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+        return key, flight.payload
+
+    def is_duplicate(self, key):
+        '''Check a fingerprint against the dedupe window, recording it if not a duplicate.
+
+        A job that then fails to print must be forgotten, or its retry is suppressed.
+
+        Args:
+            key: the job fingerprint.
+        Returns:
+            True if an identical job was submitted within the window and not forgotten.
+        Raises:
+            None
+        '''
+        if not self.window:
+            return False
+        now = time.time()
+        with self._lock:
+            last = self._printed.get(key)
+            if last is not None and now - last < self.window:
+                self.suppressed += 1
+                return True
+            self._printed[key] = now
+            if len(self._printed) > self.encoded.maxsize:
+                self._printed = dict((k, t) for k, t in self._printed.items() if now - t < self.window)
+            return False
+
+    def forget(self, key):
+        '''Drop a fingerprint from the dedupe window, e.g. after its job failed.
+
+        Args:
+            key: the job fingerprint.
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        with self._lock:
+            self._printed.pop(key, None)
+
+    def print_job(self, spec, copies=None):
+        '''Compile and print a job.
+
+        Args:
+            spec: the job description.
+            copies: explicit number of copies, always printed. None prints one copy
+            unless the job is a duplicate within the dedupe window.
+        Returns:
+            The number of copies printed, 0 for a suppressed duplicate.
+        Raises:
+            Whatever compile or send raise.
+        '''
+        key, payload = self.encode(spec)
+        if copies is not None:
+            for _ in range(copies):
+                self.send(payload)
+            return copies
+        if self.is_duplicate(key):
+            return 0
+        try:
+            self.send(payload)
+        except Exception:
+            self.forget(key)
+            raise
+        return 1
@@ -0,0 +1,204 @@
+'''Label Composition for Continuous Tape
+
+Description:
+Packs many small labels into a single raster job on continuous length tape. Labels are
+laid out one after another along the tape, separated by a small gap, and optionally
+side by side when they are narrower than the tape. A whole strip of labels then costs
+one page header, one feed and one cut, instead of a feed and cut per label.
+
+A strip longer than the printer's longest page is printed as several pages, which are
+not cut apart: with cut='end' only the last page is cut, with cut='every' the last page
+of each group of cut_every labels. chain=True leaves out the cut after the last page,
+so the next job continues the tape.
+'''
+import numpy
+
+from .bitimage import to_bitmap
+from .raster import RasterJob, continuous_media
+
+
+# Longest page the printer accepts on continuous tape, in dots (1m at 300 dpi).
+MAX_PAGE_LENGTH = 11811
+
+
+class LabelComposer:
+    '''Collects labels and composes them into a raster job.
+
+    Attributes:
+        labels: list of label bitmaps, in the order they were added.
+    '''
+
+    def __init__(self, media_width=62, gap=8, cut='end', cut_every=1, pack=False,
+                 max_page_length=MAX_PAGE_LENGTH, chain=False, **job_options):
+        '''Set up a composer.
+
+        Args:
+            media_width: continuous tape width in mm.
+            gap: blank dots between neighbouring labels, along and across the tape.
+            cut: 'end' cuts once after all the labels, 'every' cuts after every cut_every labels.
+            cut_every: labels per cut when cut is 'every'.
+            pack: place labels side by side when they fit across the tape.
+            max_page_length: longest page, in dots. Longer strips are split into pages.
+            chain: do not cut after the last label, so the next job follows on the tape.
+            job_options: further RasterJob settings, e.g. compress or high_resolution.
+            They override the cut settings derived from cut and chain.
+        Raises:
+            RuntimeError: Invalid cut setting.
+            RuntimeError: Invalid media width.
+        '''
+        if cut not in ('end', 'every') or cut_every < 1:
+            raise RuntimeError('Invalid cut setting.')
+        if media_width not in continuous_media:
+            raise RuntimeError('Invalid media width.')
+        self.media_width = media_width
+        self.width = continuous_media[media_width][0]
+        self.gap = gap
+        self.cut = cut
+        self.cut_every = cut_every
+        self.pack = pack
+        self.max_page_length = max_page_length
+        self.chain = chain
+        self.job_options = job_options
+        self.labels = []
+
+    def add(self, image, copies=1):
+        '''Queue a label.
+
+        Args:
+            image: a PIL image or NumPy array, see bitimage.to_bitmap.
+            copies: how many times to print the label.
+        Returns:
+            None
+        Raises:
+            RuntimeError: Label too wide for the tape.
+            RuntimeError: Label too long for a page.
+        '''
+        bitmap = to_bitmap(image)
+        height, width = bitmap.shape
+        if width > self.width:
+            raise RuntimeError('Label too wide for the tape.')
+        if height > self.max_page_length:
+            raise RuntimeError('Label too long for a page.')
+        self.labels.extend([bitmap] * copies)
+
+    def _shelves(self, labels):
+        # Next fit shelf packing, keeping the labels in order.
+        shelves = []
+        used = self.width
+        for label in labels:
+            width = label.shape[1]
+            if self.pack and shelves and used + self.gap + width <= self.width:
+                shelves[-1].append(label)
+                used += self.gap + width
+            else:
+                shelves.append([label])
+                used = width
+        return shelves
+
+    def _page(self, shelves):
+        heights = [max(label.shape[0] for label in shelf) for shelf in shelves]
+        page = numpy.zeros((sum(heights) + self.gap * (len(shelves) - 1), self.width), dtype=numpy.bool_)
+        top = 0
+        for shelf, height in zip(shelves, heights):
+            left = 0
+            for label in shelf:
+                page[top:top + label.shape[0], left:left + label.shape[1]] = label
+                left += label.shape[1] + self.gap
+            top += height + self.gap
+        return page
+
+    def groups(self):
+        '''Lay the queued labels out into pages, grouped by cut.
+
+        Args:
+            None
+        Returns:
+            List of groups, each a list of 2D numpy bool arrays the width of the
+            printable area. A group is one page unless longer than max_page_length.
+        Raises:
+            None
+        '''
+        per_cut = self.cut_every if self.cut == 'every' else len(self.labels)
+        groups = []
+        for first in range(0, len(self.labels), per_cut):
+            pages = []
+            shelves = []
+            length = -self.gap
+            for shelf in self._shelves(self.labels[first:first + per_cut]):
+                height = max(label.shape[0] for label in shelf)
+                if shelves and length + self.gap + height > self.max_page_length:
+                    pages.append(self._page(shelves))
+                    shelves = []
+                    length = -self.gap
+                shelves.append(shelf)
+                length += self.gap + height
+            if shelves:
+                pages.append(self._page(shelves))
+            groups.append(pages)
+        return groups
+
+    def pages(self):
+        '''Lay the queued labels out into pages.
+
+        Args:
+            None
+        Returns:
+            List of 2D numpy bool arrays, each the width of the printable area.
+        Raises:
+            None
+        '''
+        return [page for group in self.groups() for page in group]
+
+    def compose(self):
+        '''Build the raster job for the queued labels.
+
+        Args:
+            None
+        Returns:
+            A RasterJob with one page per cut, or per max_page_length of tape.
+        Raises:
+            RuntimeError: No labels queued.
+            RuntimeError: Invalid cut setting.
+        '''
+        if not self.labels:
+            raise RuntimeError('No labels queued.')
+        options = {'auto_cut': False, 'cut_every': 1, 'cut_at_end': not self.chain}
+        options.update(self.job_options)
+        job = RasterJob(media_width=self.media_width, **options)
+        groups = self.groups()
+        # With cut='every' each page says whether it ends a group. An auto_cut given
+        # in the job options applies to every page instead.
+        per_page = self.cut == 'every' and 'auto_cut' not in self.job_options
+        for number, group in enumerate(groups):
+            for index, page in enumerate(group):
+                cut = None
+                if per_page:
+                    cut = index == len(group) - 1 and (number < len(groups) - 1 or not self.chain)
+                job.add_page(page, cut)
+        return job
+
+    def chunks(self, copies=1, link_rate=None):
+        '''Compose the queued labels and compile the job in pieces, see RasterJob.chunks.
+
+        Args:
+            copies: number of times to print the job.
+            link_rate: bytes per second to the printer, for compress='auto'.
+        Returns:
+            List of bytes.
+        Raises:
+            RuntimeError: No labels queued.
+        '''
+        return self.compose().chunks(copies, link_rate)
+
+    def compile(self, copies=1, link_rate=None):
+        '''Compose the queued labels and compile the job.
+
+        Args:
+            copies: number of times to print the job.
+            link_rate: bytes per second to the printer, for compress='auto'.
+        Returns:
+            bytes
+        Raises:
+            RuntimeError: No labels queued.
+        '''
+        return self.compose().compile(copies, link_rate)
@@ -0,0 +1,393 @@
+'''Brother Command Stream Decoder
+
+Description:
+Turns the bytes produced by BrotherPrint (ESC/P, template and raster commands) back into
+a list of typed commands, so a misprinted label can be traced to the command that caused
+it and label payloads can be accounted for byte by byte.
+
+The decoder is incremental: feed() it chunks as they are captured and it returns every
+command that is complete so far, keeping only the unfinished tail buffered. Mode switches
+(ESC i a) inside the stream are followed automatically. The unfinished tail is kept in
+a bytearray that chunks are appended to, and an unfinished text run is not rescanned, so
+feeding a stream in small chunks costs about as much as decoding it in one call.
+'''
+import re
+from collections import namedtuple
+
+
+ESC = 0x1b
+
+Command = namedtuple('Command', ['mode', 'name', 'params', 'data', 'offset', 'size'])
+Command.__doc__ = '''A decoded command.
+
+    mode: 'escp', 'template' or 'raster', the printer mode the command was read in.
+    name: short command name, e.g. 'bold' or 'raster_line'.
+    params: dict of decoded parameters.
+    data: payload bytes (text, barcode data, raster line), or b''.
+    offset: position of the first byte of the command in the stream.
+    size: number of bytes the command takes in the stream.
+'''
+
+modes = {0x00: 'escp', 0x30: 'escp',
+         0x01: 'raster', 0x31: 'raster',
+         0x03: 'template', 0x33: 'template'}
+
+# Single byte controls valid in ESC/P and template mode.
+controls = {0x09: 'horz_tab',
+            0x0a: 'line_feed',
+            0x0b: 'vert_tab',
+            0x0c: 'page_feed',
+            0x0d: 'carriage_return',
+            0x0f: 'compressed_char_on',
+            0x12: 'compressed_char_off'}
+
+# ESC x with no parameters.
+esc_plain = {0x40: 'initialize',
+             0x45: 'bold_on', 0x46: 'bold_off',
+             0x34: 'italic_on', 0x35: 'italic_off',
+             0x47: 'double_strike_on', 0x48: 'double_strike_off',
+             0x50: 'pica_pitch', 0x4d: 'elite_pitch', 0x67: 'micron_pitch',
+             0x30: 'feed_1/8', 0x32: 'feed_1/6'}
+
+# ESC x n with a fixed number of parameter bytes.
+esc_fixed = {0x52: ('select_charset', 1),
+             0x74: ('select_char_code_table', 1),
+             0x4a: ('forward_feed', 1),
+             0x49: ('left_margin', 1),
+             0x51: ('right_margin', 1),
+             0x6b: ('select_font', 1),
+             0x71: ('char_style', 1),
+             0x20: ('char_spacing', 1),
+             0x57: ('double_width', 1),
+             0x2d: ('underline', 1),
+             0x61: ('alignment', 1),
+             0x70: ('proportional_char', 1),
+             0x33: ('feed_x/180', 1),
+             0x41: ('feed_x/60', 1),
+             0x58: ('char_size', 3),
+             0x24: ('abs_horz_pos', 2),
+             0x5c: ('rel_horz_pos', 2)}
+
+# ESC i x with a fixed number of parameter bytes.
+esc_i_fixed = {0x53: ('status_request', 0),
+               0x43: ('cut_setting', 1),
+               0x4c: ('rotated_printing', 1),
+               0x66: ('frame', 1),
+               0x7a: ('print_information', 10),
+               0x4d: ('various_mode', 1),
+               0x41: ('cut_every', 1),
+               0x4b: ('expanded_mode', 1),
+               0x64: ('margin', 2)}
+
+# Barcode setting letters and the number of value bytes following each.
+barcode_settings = {0x72: 1, 0x68: 2, 0x77: 1, 0x65: 1, 0x6f: 1, 0x63: 1, 0x7a: 1, 0x66: 1}
+
+# ESC i x 2D barcodes: settings bytes, then data ended by three backslashes.
+barcodes_2d = {0x51: ('qr', 8),
+               0x56: ('pdf417', 5),
+               0x44: ('datamatrix', 4),
+               0x55: ('maxicode', 1)}
+
+# ESC ( x nL nH data
+esc_paren = {0x43: 'page_length',
+             0x63: 'page_format',
+             0x56: 'abs_vert_pos'}
+
+# ^XX template commands with a fixed number of parameter bytes.
+template_fixed = {b'II': ('template_init', 0),
+                  b'FF': ('template_print', 0),
+                  b'CN': ('copies', 3),
+                  b'TS': ('choose_template', 3),
+                  b'OP': ('machine_op', 1),
+                  b'PT': ('print_start_trigger', 1),
+                  b'PC': ('received_char_count', 3),
+                  b'SS': ('select_delim', 2)}
+
+
+# The bytes that end a text run, in ESC/P and in template mode.
+_escp_text_end = re.compile(b'[\x1b' + bytes(sorted(controls)) + b']')
+_template_text_end = re.compile(b'[\x1b' + bytes(sorted(controls)) + b'^]')
+
+
+def _digit(value):
+    # The template commands are sent both as ASCII digits and as raw values.
+    if 0x30 <= value <= 0x39:
+        return value - 0x30
+    return value
+
+
+class Decoder:
+    '''Incremental decoder for Brother command streams.
+
+    Attributes:
+        mode: the printer mode the next byte will be read in.
+        offset: stream position of the first byte still buffered.
+    '''
+
+    def __init__(self, mode='escp'):
+        if mode not in ('escp', 'template', 'raster'):
+            raise RuntimeError('Invalid mode.')
+        self.mode = mode
+        self.offset = 0
+        self.buffer = bytearray()
+        # Where the scan of an unfinished text run at the start of the buffer stopped.
+        self.scan = 0
+
+    def feed(self, data):
+        '''Decode another chunk of the stream.
+
+        Args:
+            data: bytes, or a str of byte values as built by BrotherPrint.
+        Returns:
+            List of the Commands completed by this chunk.
+        Raises:
+            None
+        '''
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        buf = self.buffer
+        buf += data
+        commands = []
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            mode = self.mode
+            if mode == 'raster':
+                parsed = self._raster(buf, pos, end)
+            else:
+                parsed = self._command(buf, pos, end, mode == 'template')
+            if parsed is None:
+                break
+            name, params, data, stop = parsed
+            commands.append(Command(mode, name, params, bytes(data), self.offset + pos, stop - pos))
+            pos = stop
+        # Dropping the front of a bytearray does not move the rest.
+        del buf[:pos]
+        self.scan = max(0, self.scan - pos)
+        self.offset += pos
+        return commands
+
+    def close(self):
+        '''Finish the stream, flushing a trailing text run.
+
+        Args:
+            None
+        Returns:
+            List of the remaining Commands. Bytes of a truncated command are
+            returned as a single 'truncated' command.
+        Raises:
+            None
+        '''
+        commands = []
+        if self.buffer:
+            name = 'truncated'
+            if self.mode != 'raster' and self.buffer[0] not in (ESC, 0x5e) and self.buffer[0] not in controls:
+                name = 'text'
+            commands.append(Command(self.mode, name, {}, bytes(self.buffer), self.offset,
+                                    len(self.buffer)))
+            self.offset += len(self.buffer)
+            self.buffer = bytearray()
+            self.scan = 0
+        return commands
+
+    def _command(self, buf, pos, end, template):
+        byte = buf[pos]
+        if byte == ESC:
+            return self._escape(buf, pos, end)
+        if template and byte == 0x5e:
+            return self._template(buf, pos, end)
+        if byte in controls:
+            return controls[byte], {}, b'', pos + 1
+        # Text run, up to the next command byte. Only complete once that byte is seen.
+        match = (_template_text_end if template else _escp_text_end).search(buf, max(pos + 1, self.scan))
+        if match is None:
+            self.scan = end
+            return None
+        return 'text', {}, buf[pos:match.start()], match.start()
+
+    def _escape(self, buf, pos, end):
+        if pos + 1 >= end:
+            return None
+        code = buf[pos + 1]
+        if code in esc_plain:
+            return esc_plain[code], {}, b'', pos + 2
+        if code in esc_fixed:
+            name, size = esc_fixed[code]
+            if pos + 2 + size > end:
+                return None
+            return name, {'args': tuple(bytearray(buf[pos + 2:pos + 2 + size]))}, b'', pos + 2 + size
+        if code == 0x69:
+            return self._esc_i(buf, pos, end)
+        if code == 0x28:
+            if pos + 5 > end:
+                return None
+            length = buf[pos + 3] + buf[pos + 4] * 256
+            if pos + 5 + length > end:
+                return None
+            name = esc_paren.get(buf[pos + 2], 'unknown')
+            return name, {'args': tuple(bytearray(buf[pos + 5:pos + 5 + length]))}, b'', pos + 5 + length
+        if code in (0x44, 0x42):
+            stop = buf.find(b'\x00', pos + 2)
+            if stop < 0:
+                return None
+            name = 'horz_tab_pos' if code == 0x44 else 'vert_tab_pos'
+            return name, {'positions': tuple(bytearray(buf[pos + 2:stop]))}, b'', stop + 1
+        if code == 0x2a:
+            if pos + 5 > end:
+                return None
+            density = buf[pos + 2]
+            columns = buf[pos + 3] + buf[pos + 4] * 256
+            stop = pos + 5 + columns * (3 if density >= 32 else 1)
+            if stop > end:
+                return None
+            return 'bit_image', {'density': density, 'columns': columns}, buf[pos + 5:stop], stop
+        return 'unknown', {'code': code}, b'', pos + 2
+
+    def _esc_i(self, buf, pos, end):
+        if pos + 2 >= end:
+            return None
+        code = buf[pos + 2]
+        start = pos + 3
+        if code == 0x61:
+            if start >= end:
+                return None
+            self.mode = modes.get(buf[start], self.mode)
+            return 'mode', {'mode': self.mode}, b'', start + 1
+        if code in esc_i_fixed:
+            name, size = esc_i_fixed[code]
+            if start + size > end:
+                return None
+            return name, {'args': tuple(bytearray(buf[start:start + size]))}, b'', start + size
+        if code == 0x74:
+            # Barcode: lettered settings up to 'b', data up to a backslash, code128
+            # and gs1-128 end with two more backslashes.
+            data_start = start + 1
+            while True:
+                if data_start >= end:
+                    return None
+                letter = buf[data_start]
+                if letter == 0x62:
+                    break
+                data_start += 1 + barcode_settings.get(letter, 0)
+            stop = buf.find(b'\\', data_start + 1)
+            if stop < 0:
+                return None
+            stop += 1
+            if buf[start] in (0x61, 0x62):
+                if stop + 2 > end:
+                    return None
+                stop += 2
+            params = {'format': chr(buf[start]), 'settings': bytes(buf[start + 1:data_start])}
+            return 'barcode', params, buf[data_start + 1:stop - 1].rstrip(b'\\'), stop
+        if code in barcodes_2d:
+            format, size = barcodes_2d[code]
+            if start + size > end:
+                return None
+            stop = buf.find(b'\\\\\\', start + size)
+            if stop < 0:
+                return None
+            params = {'format': format, 'args': tuple(bytearray(buf[start:start + size]))}
+            return 'barcode_2d', params, buf[start + size:stop], stop + 3
+        return 'unknown', {'code': code}, b'', start
+
+    def _template(self, buf, pos, end):
+        if pos + 3 > end:
+            return None
+        code = bytes(buf[pos + 1:pos + 3])
+        start = pos + 3
+        if code in template_fixed:
+            name, size = template_fixed[code]
+            if start + size > end:
+                return None
+            args = tuple(_digit(value) for value in bytearray(buf[start:start + size]))
+            return name, {'args': args}, b'', start + size
+        if code == b'ON':
+            stop = buf.find(b'\x00', start)
+            if stop < 0:
+                return None
+            return 'select_obj', {'name': buf[start:stop].decode('latin-1')}, b'', stop + 1
+        if code == b'DI':
+            if start + 2 > end:
+                return None
+            stop = start + 2 + buf[start] + buf[start + 1] * 256
+            if stop > end:
+                return None
+            return 'insert_into_obj', {}, buf[start + 2:stop], stop
+        if code == b'PS':
+            if start + 2 > end:
+                return None
+            stop = start + 2 + _digit(buf[start]) * 10 + _digit(buf[start + 1])
+            if stop > end:
+                return None
+            return 'print_start_command', {}, buf[start + 2:stop], stop
+        return 'unknown', {'code': code.decode('latin-1')}, b'', start
+
+    def _raster(self, buf, pos, end):
+        byte = buf[pos]
+        if byte == 0x00:
+            stop = pos + 1
+            while stop < end and buf[stop] == 0x00:
+                stop += 1
+            if stop == end:
+                return None
+            return 'invalidate', {}, b'', stop
+        if byte == 0x67:
+            if pos + 3 > end:
+                return None
+            stop = pos + 3 + buf[pos + 2]
+            if stop > end:
+                return None
+            return 'raster_line', {}, buf[pos + 3:stop], stop
+        if byte == 0x77:
+            if pos + 3 > end:
+                return None
+            stop = pos + 3 + buf[pos + 2]
+            if stop > end:
+                return None
+            return 'raster_line', {'color': buf[pos + 1]}, buf[pos + 3:stop], stop
+        if byte == 0x5a:
+            return 'zero_line', {}, b'', pos + 1
+        if byte == 0x4d:
+            if pos + 2 > end:
+                return None
+            return 'compression', {'args': (buf[pos + 1],)}, b'', pos + 2
+        if byte == 0x0c:
+            return 'print', {}, b'', pos + 1
+        if byte == 0x1a:
+            return 'print_feed', {}, b'', pos + 1
+        if byte == ESC:
+            return self._escape(buf, pos, end)
+        return 'unknown', {'code': byte}, b'', pos + 1
+
+
+def decode(data, mode='escp'):
+    '''Decode a complete command stream.
+
+    Args:
+        data: the stream, bytes or a str of byte values.
+        mode: printer mode at the start of the stream, 'escp', 'template' or 'raster'.
+    Returns:
+        List of Commands.
+    Raises:
+        RuntimeError: Invalid mode.
+    '''
+    decoder = Decoder(mode)
+    return decoder.feed(data) + decoder.close()
+
+
+def size_report(commands):
+    '''Account the bytes of a decoded stream per command type.
+
+    Args:
+        commands: iterable of Commands.
+    Returns:
+        List of (name, count, bytes) tuples, largest byte total first.
+    Raises:
+        None
+    '''
+    totals = {}
+    for command in commands:
+        count, size = totals.get(command.name, (0, 0))
+        totals[command.name] = (count + 1, size + command.size)
+    return sorted(((name, count, size) for name, (count, size) in totals.items()),
+                  key=lambda entry: (-entry[2], entry[0]))
@@ -0,0 +1,383 @@
+'''Brother QL Network Discovery
+
+Description:
+Finds Brother QL printers listening on the raw printing port of the local network,
+reads their model and loaded media from the status information they send back, and
+hands out connections that are ready to be passed to BrotherPrint. Hosts are probed
+in parallel so warming up a whole room of printers takes about as long as the slowest
+one to answer.
+
+Reading the status means writing ESC @ ESC i S to the host, which other printers on
+the raw port print as a junk page. connect_all queries the addresses it is given,
+which are meant to be known QL printers. A subnet scan with discover first asks each
+host for its model over SNMP, which writes nothing to the raw port, and only requests
+the status of hosts that name themselves QL printers. Hosts that identify as other
+devices are skipped; hosts that do not answer SNMP are kept with a status of None.
+probe=True requests the status of every host instead.
+
+The network side lives in SocketBackend. Anything with the same connect/query/close
+(and optionally identify) methods can be passed in its place, which is how tests run without printers.
+'''
+import socket
+import ipaddress
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .brotherprint import BrotherPrint
+
+
+DEFAULT_PORT = 9100
+STATUS_SIZE = 32
+SNMP_PORT = 161
+# HOST-RESOURCES-MIB hrDeviceDescr.1, e.g. 'Brother QL-820NWB'.
+DEVICE_DESCRIPTION = (1, 3, 6, 1, 2, 1, 25, 3, 2, 1, 3, 1)
+
+models = {0x31: 'QL-560',
+          0x32: 'QL-570',
+          0x33: 'QL-580N',
+          0x34: 'QL-1060N',
+          0x35: 'QL-700',
+          0x36: 'QL-710W',
+          0x37: 'QL-720NW',
+          0x38: 'QL-800',
+          0x39: 'QL-810W',
+          0x41: 'QL-820NWB',
+          0x50: 'QL-1050',
+          0x51: 'QL-650TD',
+          }
+
+media_types = {0x00: None,
+               0x0A: 'continuous',
+               0x0B: 'die-cut',
+               0x4A: 'continuous',
+               0x4B: 'die-cut',
+               }
+
+status_types = {0x00: 'reply',
+                0x01: 'printing completed',
+                0x02: 'error',
+                0x05: 'notification',
+                0x06: 'phase change',
+                }
+
+errors = ['no media',
+          'end of media',
+          'cutter jam',
+          None,
+          'printer in use',
+          'printer turned off',
+          'high-voltage adapter',
+          'fan motor error',
+          'replace media',
+          'expansion buffer full',
+          'communication error',
+          'communication buffer full',
+          'cover open',
+          'cancel key',
+          'media cannot be fed',
+          'system error',
+          ]
+
+
+PrinterStatus = namedtuple('PrinterStatus', ['model', 'media_width', 'media_length',
+                                             'media_type', 'status_type', 'errors'])
+
+
+def parse_status(data):
+    '''Decode the 32 byte status information sent back by a QL printer.
+
+    Args:
+        data: the raw status bytes.
+    Returns:
+        A PrinterStatus. media_width and media_length are in millimetres, a length
+        of 0 means continuous tape.
+    Raises:
+        RuntimeError: Invalid status response.
+    '''
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    data = bytearray(data)
+    if len(data) != STATUS_SIZE or data[0] != 0x80 or data[1] != STATUS_SIZE:
+        raise RuntimeError('Invalid status response.')
+    error_bits = data[8] | (data[9] << 8)
+    return PrinterStatus(model=models.get(data[4], 'unknown (0x%02x)' % data[4]),
+                         media_width=data[10],
+                         media_length=data[17],
+                         media_type=media_types.get(data[11]),
+                         status_type=status_types.get(data[18]),
+                         errors=[name for bit, name in enumerate(errors)
+                                 if name and error_bits & (1 << bit)])
+
+
+def _ber(tag, payload):
+    # One BER type-length-value.
+    if len(payload) < 0x80:
+        return bytes([tag, len(payload)]) + payload
+    length = len(payload).to_bytes((len(payload).bit_length() + 7) // 8, 'big')
+    return bytes([tag, 0x80 | len(length)]) + length + payload
+
+
+def _ber_items(data):
+    # Split BER contents into (tag, value) pairs.
+    items = []
+    offset = 0
+    while offset < len(data):
+        if offset + 2 > len(data):
+            raise RuntimeError('Invalid SNMP response.')
+        tag, size = data[offset], data[offset + 1]
+        offset += 2
+        if size & 0x80:
+            count = size & 0x7F
+            size = int.from_bytes(data[offset:offset + count], 'big')
+            offset += count
+        if offset + size > len(data):
+            raise RuntimeError('Invalid SNMP response.')
+        items.append((tag, data[offset:offset + size]))
+        offset += size
+    return items
+
+
+def snmp_request(oid=DEVICE_DESCRIPTION, community=b'public', request_id=1):
+    '''Build an SNMPv1 GetRequest for a single object.
+
+    Args:
+        oid: object identifier as a tuple of integers.
+        community: the read community.
+        request_id: identifier echoed back in the response.
+    Returns:
+        The request datagram.
+    Raises:
+        None
+    '''
+    encoded = bytearray([40 * oid[0] + oid[1]])
+    for number in oid[2:]:
+        digits = [number & 0x7F]
+        number >>= 7
+        while number:
+            digits.append(0x80 | (number & 0x7F))
+            number >>= 7
+        encoded += bytes(reversed(digits))
+    binding = _ber(0x30, _ber(0x30, _ber(0x06, bytes(encoded)) + _ber(0x05, b'')))
+    pdu = _ber(0xA0, _ber(0x02, request_id.to_bytes(request_id.bit_length() // 8 + 1, 'big')) + _ber(0x02, b'\x00') + _ber(0x02, b'\x00')
+               + binding)
+    return _ber(0x30, _ber(0x02, b'\x00') + _ber(0x04, community) + pdu)
+
+
+def parse_snmp_response(data, request_id=1):
+    '''Read the string value out of an SNMPv1 GetResponse.
+
+    Args:
+        data: the response datagram.
+        request_id: identifier of the request it answers.
+    Returns:
+        The value as a str, or None if the agent reported an error or the value is
+        not a string.
+    Raises:
+        RuntimeError: Invalid SNMP response.
+    '''
+    try:
+        (tag, message), = _ber_items(bytes(data))
+        version, community, (pdu_tag, pdu) = _ber_items(message)
+        identifier, error, _, (_, bindings) = _ber_items(pdu)
+        (_, binding), = _ber_items(bindings)
+        _, (value_tag, value) = _ber_items(binding)
+    except ValueError:
+        raise RuntimeError('Invalid SNMP response.')
+    if tag != 0x30 or pdu_tag != 0xA2 or int.from_bytes(identifier[1], 'big') != request_id:
+        raise RuntimeError('Invalid SNMP response.')
+    if error[1].strip(b'\x00') or value_tag != 0x04:
+        return None
+    return value.decode('latin-1')
+
+
+class SocketBackend:
+    '''Talks to printers over plain TCP sockets.'''
+
+    def connect(self, address, timeout):
+        '''Open a connection to a printer.
+
+        Args:
+            address: (host, port) tuple.
+            timeout: seconds to wait for the printer to accept.
+        Returns:
+            The connected socket.
+        Raises:
+            socket.error: Nothing is listening at the address.
+        '''
+        fsocket = socket.create_connection(address, timeout)
+        fsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return fsocket
+
+    def identify(self, address, timeout):
+        '''Ask a host for its device description over SNMP, writing nothing to the
+        raw printing port.
+
+        Args:
+            address: (host, port) tuple. Only the host is used.
+            timeout: seconds to wait for the answer.
+        Returns:
+            The description, e.g. 'Brother QL-820NWB', or None if the host did not
+            answer.
+        Raises:
+            None
+        '''
+        fsocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            fsocket.settimeout(timeout)
+            fsocket.sendto(snmp_request(), (address[0], SNMP_PORT))
+            return parse_snmp_response(fsocket.recv(1500))
+        except (socket.error, OSError, RuntimeError):
+            return None
+        finally:
+            fsocket.close()
+
+    def query(self, fsocket, timeout):
+        '''Request and read the status information of a connected printer.
+
+        Args:
+            fsocket: a socket returned by connect.
+            timeout: seconds to wait for the full reply.
+        Returns:
+            The raw status bytes.
+        Raises:
+            socket.error: The printer did not answer in time.
+        '''
+        fsocket.settimeout(timeout)
+        fsocket.sendall(b'\x1b@\x1biS')
+        data = b''
+        while len(data) < STATUS_SIZE:
+            chunk = fsocket.recv(STATUS_SIZE - len(data))
+            if not chunk:
+                break
+            data += chunk
+        fsocket.settimeout(None)
+        return data
+
+    def close(self, fsocket):
+        fsocket.close()
+
+
+class Printer:
+    '''A discovered printer with an open connection.
+
+    Attributes:
+        address: (host, port) tuple.
+        status: the PrinterStatus read while probing, or None if it was not queried.
+        fsocket: the open connection.
+        job: a BrotherPrint bound to fsocket.
+    '''
+
+    def __init__(self, address, status, fsocket):
+        self.address = address
+        self.status = status
+        self.fsocket = fsocket
+        self.job = BrotherPrint(fsocket)
+
+    def __repr__(self):
+        if self.status is None:
+            return '<Printer %s:%d>' % self.address
+        return '<Printer %s:%d %s %dmm %s>' % (self.address[0], self.address[1], self.status.model,
+                                               self.status.media_width, self.status.media_type)
+
+
+def local_network():
+    '''Guess the /24 network of the interface used for the default route.
+
+    Args:
+        None
+    Returns:
+        An ipaddress.IPv4Network.
+    Raises:
+        RuntimeError: No usable network interface.
+    '''
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # Nothing is sent for a UDP connect, it only picks the outgoing interface.
+        probe.connect(('10.255.255.255', 1))
+        host = probe.getsockname()[0]
+    except socket.error:
+        raise RuntimeError('No usable network interface.')
+    finally:
+        probe.close()
+    return ipaddress.ip_network(host + '/24', strict=False)
+
+
+def _probe(address, timeout, backend, keep_open, query=True):
+    # query=None requests the status only from hosts that identify as QL printers.
+    if query is None:
+        identify = getattr(backend, 'identify', None)
+        description = identify(address, timeout) if identify else None
+        if description is not None and 'QL-' not in description:
+            return None
+        query = description is not None
+    try:
+        fsocket = backend.connect(address, timeout)
+    except (socket.error, OSError):
+        return None
+    status = None
+    try:
+        if query:
+            status = parse_status(backend.query(fsocket, timeout))
+    except (socket.error, OSError, RuntimeError):
+        backend.close(fsocket)
+        return None
+    if not keep_open:
+        backend.close(fsocket)
+        fsocket = None
+    return Printer(address, status, fsocket)
+
+
+def connect_all(addresses, port=DEFAULT_PORT, timeout=2.0, workers=32, backend=None, keep_open=True,
+                query=True):
+    '''Connect to a list of known printers in parallel and read their status.
+
+    Args:
+        addresses: host names, or (host, port) tuples.
+        port: port used for entries given as bare host names.
+        timeout: per printer connect and status timeout, in seconds.
+        workers: maximum number of printers probed at the same time.
+        backend: object providing connect, query and close. Defaults to SocketBackend.
+        keep_open: leave the connections open so they can be used for printing.
+        query: request the status, which writes to the printer. False only connects.
+    Returns:
+        List of Printer, in the order of addresses, for every printer that answered.
+    Raises:
+        None
+    '''
+    backend = backend or SocketBackend()
+    addresses = [address if isinstance(address, tuple) else (str(address), port)
+                 for address in addresses]
+    if not addresses:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(addresses))) as pool:
+        found = pool.map(lambda address: _probe(address, timeout, backend, keep_open, query),
+                         addresses)
+        return [printer for printer in found if printer]
+
+
+def discover(network=None, port=DEFAULT_PORT, timeout=0.5, workers=128, backend=None, keep_open=True,
+             probe=False):
+    '''Scan a subnet for QL printers accepting raw print connections.
+
+    Args:
+        network: network to scan, e.g. '192.168.1.0/24'. Defaults to the local /24.
+        port: raw printing port.
+        timeout: per host timeout, in seconds. Hosts without a printer mostly cost this.
+        workers: maximum number of hosts probed at the same time.
+        backend: object providing connect, query, close and optionally identify.
+        Defaults to SocketBackend.
+        keep_open: leave the connections open so they can be used for printing.
+        probe: request the status of every host found, keeping only QL printers. This
+        writes to every host listening on the port, see the module description.
+    Returns:
+        List of Printer, ordered by address. Printers that identified as QL models
+        carry their status; hosts that could not be identified have a status of None.
+    Raises:
+        RuntimeError: No usable network interface.
+    '''
+    if network is None:
+        network = local_network()
+    hosts = ipaddress.ip_network(network, strict=False).hosts()
+    return connect_all([(str(host), port) for host in hosts], timeout=timeout,
+                       workers=workers, backend=backend, keep_open=keep_open,
+                       query=True if probe else None)
@@ -0,0 +1,407 @@
+'''Local HTTP Print Gateway
+
+Description:
+A small HTTP/JSON server that accepts template-fill and raster jobs, so services can
+print labels without embedding BrotherPrint or handling printer sockets. Jobs for the
+same printer that arrive within a short window are compiled into one stream and sent
+in a single write over a persistent connection, with the template mode header sent
+once per batch instead of once per label.
+
+Endpoints:
+    POST /jobs        submit a job, returns {"id": ..., "status": ...}
+    GET  /jobs/<id>   job status: 'queued', 'sent' or 'failed'
+
+Job bodies:
+    {"printer": "shipping", "type": "template", "template": 3,
+     "fields": {"name": "Bob", "order": "1234"}}
+    {"printer": "shipping", "type": "raster", "width": 696, "height": 200,
+     "data": "<base64 packed rows, 1 bit per dot, most significant bit first>",
+     "media_width": 62}
+Add "wait": true to answer only once the job has been sent or has failed, and
+"copies": n to print n copies with the printer's own copy count. Identical jobs share
+one compiled encoding; with a dedupe window set, a job identical to one queued for the
+same printer within the window is answered with status 'duplicate' and not printed,
+unless it gives explicit copies. A job that fails does not count, so retrying it prints.
+'''
+import base64
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .brotherprint import BrotherPrint
+from .coalesce import Coalescer
+from .transport import MemoryTransport, connect_socket
+
+
+TEMPLATE_HEADER = chr(27)+'ia3'+'^II'
+
+# Job body keys that do not change what is printed.
+delivery_keys = ('printer', 'wait', 'timeout')
+
+
+def compile_job(spec):
+    '''Compile a JSON job description.
+
+    Args:
+        spec: the decoded job body, see the module description.
+    Returns:
+        A (header, body) tuple of bytes. Consecutive jobs with the same header only
+        need it sent once.
+    Raises:
+        RuntimeError: Invalid job.
+        RuntimeError: Invalid template.
+        RuntimeError: Invalid field.
+        RuntimeError: Invalid copies.
+    '''
+    kind = spec.get('type')
+    copies = spec.get('copies') or 1
+    buf = MemoryTransport()
+    job = BrotherPrint(buf)
+    if kind == 'template':
+        template = spec.get('template')
+        if isinstance(template, str) and template.isdigit():
+            template = int(template)
+        if isinstance(template, bool) or not isinstance(template, int) or not 0 < template < 100:
+            raise RuntimeError('Invalid template.')
+        fields = spec.get('fields', {})
+        if isinstance(fields, dict):
+            fields = list(fields.items())
+        if not isinstance(fields, list):
+            raise RuntimeError('Invalid field.')
+        for field in fields:
+            if (not isinstance(field, (list, tuple)) or len(field) != 2
+                    or not all(isinstance(value, str) for value in field)):
+                raise RuntimeError('Invalid field.')
+            try:
+                for value in field:
+                    value.encode('latin-1')
+            except UnicodeEncodeError:
+                raise RuntimeError('Invalid field.')
+        job.choose_template(template)
+        for name, data in fields:
+            job.select_and_insert(name, data)
+        job.template_print(copies)
+        return TEMPLATE_HEADER.encode('latin-1'), buf.getvalue()
+    if kind == 'raster':
+        import numpy
+        from .raster import RasterJob
+        try:
+            width, height = int(spec['width']), int(spec['height'])
+            rows = numpy.frombuffer(base64.b64decode(spec['data']), dtype=numpy.uint8)
+            rows = rows.reshape(height, (width + 7) // 8)
+            media_width = int(spec.get('media_width', 62))
+        except (KeyError, TypeError, ValueError):
+            raise RuntimeError('Invalid job.')
+        if width < 1 or height < 1 or not 0 < media_width < 256:
+            raise RuntimeError('Invalid job.')
+        raster = RasterJob(media_width=media_width)
+        raster.add_page(numpy.unpackbits(rows, axis=1, count=width).view(numpy.bool_))
+        job.print_raster(raster, copies)
+        return b'', buf.getvalue()
+    raise RuntimeError('Invalid job.')
+
+
+class Job:
+    '''A submitted job.
+
+    Attributes:
+        id: the job id.
+        printer: name of the printer it goes to.
+        status: 'queued', 'sent', 'failed' or 'duplicate'.
+        error: failure message, or None.
+        key: the dedupe key it was recorded under, or None.
+        done: threading.Event set once the job is sent or has failed.
+    '''
+
+    def __init__(self, printer, header, body):
+        self.id = uuid.uuid4().hex
+        self.printer = printer
+        self.header = header
+        self.body = body
+        self.status = 'queued'
+        self.error = None
+        self.key = None
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def finish(self, error=None):
+        self.status = 'failed' if error else 'sent'
+        self.error = error
+        self.finished = time.time()
+        self.header = self.body = None
+        self.done.set()
+
+    def as_dict(self):
+        return {'id': self.id, 'printer': self.printer, 'status': self.status, 'error': self.error}
+
+
+class Batcher(threading.Thread):
+    '''Collects the jobs of one printer and sends them in batches.'''
+
+    def __init__(self, name, address, connect, window, max_batch, finished=None):
+        threading.Thread.__init__(self, name='brotherprint-batcher-%s' % name)
+        self.daemon = True
+        self.address = address
+        self.connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self.finished = finished
+        self.connection = None
+        self.jobs = []
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def put(self, job):
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def take(self):
+        with self.condition:
+            while not self.jobs and not self.stopped:
+                self.condition.wait()
+            if not self.jobs:
+                return []
+            # Hold the batch open for the rest of the window after the first job.
+            deadline = self.jobs[0].submitted + self.window
+            while len(self.jobs) < self.max_batch and not self.stopped:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, self.jobs = self.jobs[:self.max_batch], self.jobs[self.max_batch:]
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.take()
+            if not batch:
+                break
+            chunks = []
+            header = None
+            for job in batch:
+                if job.header and job.header != header:
+                    chunks.append(job.header)
+                header = job.header
+                chunks.append(job.body)
+            error = None
+            try:
+                if self.connection is None:
+                    self.connection = self.connect(self.address)
+                self.connection.send(b''.join(chunks))
+            except Exception as e:
+                # Whatever the connection or a custom connect raises fails this batch
+                # only; the next batch reconnects.
+                error = str(e) or e.__class__.__name__
+                self.close()
+            for job in batch:
+                job.finish(error)
+                if self.finished is not None:
+                    self.finished(job)
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class Gateway:
+    '''The print gateway: job registry, per printer batchers and the HTTP server.
+
+    Attributes:
+        server: the HTTP server, once started.
+    '''
+
+    def __init__(self, printers, address=('127.0.0.1', 8631), window=0.05, max_batch=200,
+                 connect=connect_socket, history=10000, dedupe_window=0):
+        '''Set up a gateway.
+
+        Args:
+            printers: dict of printer name to (host, port) address, or to anything
+            connect accepts.
+            address: (host, port) the HTTP server listens on. Port 0 picks a free port.
+            window: seconds a batch is held open after its first job arrives.
+            max_batch: most jobs sent in one batch.
+            connect: called with a printer address, returns an object with send(bytes)
+            and close().
+            history: number of finished jobs kept for status queries.
+            dedupe_window: seconds within which an identical job for the same printer
+            is not printed again, 0 to print every job.
+        Raises:
+            None
+        '''
+        self.address = address
+        self.history = history
+        self.jobs = OrderedDict()
+        self.done = deque()
+        self.lock = threading.Lock()
+        self.coalescer = Coalescer(compile=compile_job, window=dedupe_window)
+        self.batchers = dict((name, Batcher(name, printer, connect, window, max_batch,
+                                            self._finished))
+                             for name, printer in printers.items())
+        self.server = None
+
+    def submit(self, spec):
+        '''Compile a job and queue it for its printer.
+
+        Args:
+            spec: the decoded job body, see the module description.
+        Returns:
+            The Job.
+        Raises:
+            RuntimeError: Invalid job.
+            RuntimeError: Unknown printer.
+            RuntimeError: Invalid copies.
+            RuntimeError: Invalid timeout.
+            RuntimeError: Invalid template.
+            RuntimeError: Invalid field.
+        '''
+        if not isinstance(spec, dict):
+            raise RuntimeError('Invalid job.')
+        name = spec.get('printer')
+        if not isinstance(name, str) or name not in self.batchers:
+            raise RuntimeError('Unknown printer.')
+        copies = spec.get('copies')
+        if copies is not None and (isinstance(copies, bool) or not isinstance(copies, int)
+                                   or copies < 1):
+            raise RuntimeError('Invalid copies.')
+        timeout = spec.get('timeout', 0)
+        if (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                or not math.isfinite(timeout) or timeout < 0):
+            raise RuntimeError('Invalid timeout.')
+        content = dict((k, v) for k, v in spec.items() if k not in delivery_keys)
+        key, (header, body) = self.coalescer.encode(content)
+        job = Job(name, header, body)
+        if copies is None and self.coalescer.window:
+            if self.coalescer.is_duplicate(name + ':' + key):
+                job.finish()
+                job.status = 'duplicate'
+            else:
+                job.key = name + ':' + key
+        with self.lock:
+            self.jobs[job.id] = job
+        if job.status == 'queued':
+            self.batchers[name].put(job)
+        else:
+            self._finished(job)
+        return job
+
+    def _finished(self, job):
+        # Called once per job when it is finished. Only finished jobs are dropped from
+        # the history, so queued jobs stay visible however long a printer is stuck.
+        if job.status == 'failed' and job.key is not None:
+            self.coalescer.forget(job.key)
+        with self.lock:
+            self.done.append(job.id)
+            while len(self.done) > self.history:
+                self.jobs.pop(self.done.popleft(), None)
+
+    def get(self, job_id):
+        '''Look up a job by id.
+
+        Args:
+            job_id: the id returned on submission.
+        Returns:
+            The Job, or None if unknown or expired.
+        Raises:
+            None
+        '''
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def start(self):
+        '''Start the batchers and serve HTTP in a background thread.
+
+        Args:
+            None
+        Returns:
+            The (host, port) the server listens on.
+        Raises:
+            socket.error: The address is in use.
+        '''
+        for batcher in self.batchers.values():
+            batcher.start()
+        self.server = ThreadingHTTPServer(self.address, _handler(self))
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, name='brotherprint-gateway')
+        thread.daemon = True
+        thread.start()
+        return self.server.server_address
+
+    def stop(self):
+        '''Stop serving, send what is queued and close the printer connections.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for batcher in self.batchers.values():
+            batcher.stop()
+        for batcher in self.batchers.values():
+            if batcher.is_alive():
+                batcher.join()
+
+
+def _handler(gateway):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def reply(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/jobs':
+                return self.reply(404, {'error': 'Not found.'})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                if length < 0:
+                    raise ValueError(length)
+                spec = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                return self.reply(400, {'error': 'Invalid JSON.'})
+            try:
+                job = gateway.submit(spec)
+            except RuntimeError as e:
+                return self.reply(400, {'error': str(e)})
+            if spec.get('wait'):
+                job.done.wait(float(spec.get('timeout', 30)))
+            self.reply(200 if job.done.is_set() else 202, job.as_dict())
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            job = gateway.get(parts[1]) if len(parts) == 2 and parts[0] == 'jobs' else None
+            if job is None:
+                return self.reply(404, {'error': 'Unknown job.'})
+            self.reply(200, job.as_dict())
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,210 @@
+'''Image Preprocessing for Raster Labels
+
+Description:
+Turns photos and greyscale artwork into the 1-bit bitmaps used by raster jobs: convert
+to grey, rotate, resize to the printable width, then threshold or dither.
+
+Error diffusion dithering looks inherently serial, since every pixel depends on the
+error left by the pixels before it. With the Floyd-Steinberg and Atkinson kernels a
+pixel only depends on pixels of the same or the two previous rows that lie further
+left, so all pixels on a skewed diagonal x + 2y = t are independent of each other.
+The image is dithered one diagonal at a time with whole-array NumPy operations, which
+takes width + 2 * height vectorized steps instead of width * height Python ones.
+
+Results are cached by the content of the source image and the processing options.
+'''
+import numpy
+
+from .cache import LRUCache, fingerprint
+
+
+# (row offset, column offset, weight) of the error passed on to each neighbour.
+kernels = {'floyd-steinberg': ((0, 1, 7 / 16.0), (1, -1, 3 / 16.0), (1, 0, 5 / 16.0), (1, 1, 1 / 16.0)),
+           'atkinson': ((0, 1, 1 / 8.0), (0, 2, 1 / 8.0), (1, -1, 1 / 8.0), (1, 0, 1 / 8.0),
+                        (1, 1, 1 / 8.0), (2, 0, 1 / 8.0))}
+
+methods = ('threshold',) + tuple(kernels)
+
+image_cache = LRUCache(32)
+
+
+def to_grey(image):
+    '''Convert an image to a 2D float array of grey levels, 0 black to 255 white.
+
+    Args:
+        image: a PIL image or a NumPy array. Boolean arrays are True for black, RGB(A)
+            arrays are converted with the ITU-R 601 luma weights.
+    Returns:
+        A 2D numpy float32 array.
+    Raises:
+        RuntimeError: Unsupported image.
+    '''
+    if hasattr(image, 'convert') and hasattr(image, 'mode'):
+        image = image.convert('L')
+    image = numpy.asarray(image)
+    if image.dtype == numpy.bool_:
+        return numpy.where(image, 0, 255).astype(numpy.float32)
+    if image.ndim == 3:
+        image = image[:, :, :3].astype(numpy.float32).dot(numpy.array([0.299, 0.587, 0.114], dtype=numpy.float32))
+    if image.ndim != 2:
+        raise RuntimeError('Unsupported image.')
+    return image.astype(numpy.float32)
+
+
+def resize(grey, width, height=None):
+    '''Resize a grey image, keeping the aspect ratio unless height is given.
+
+    Large reductions are box filtered down to within a factor of two first, the rest
+    is bilinear interpolation.
+
+    Args:
+        grey: 2D float array.
+        width: new width in dots.
+        height: new height in dots, defaults to keeping the aspect ratio.
+    Returns:
+        A 2D numpy float32 array.
+    Raises:
+        None
+    '''
+    h, w = grey.shape
+    if height is None:
+        height = max(1, int(round(h * width / float(w))))
+    fy, fx = h // height, w // width
+    if fy >= 2 or fx >= 2:
+        fy, fx = max(fy, 1), max(fx, 1)
+        h, w = h // fy * fy, w // fx * fx
+        grey = grey[:h, :w].reshape(h // fy, fy, w // fx, fx).mean(axis=(1, 3))
+        h, w = grey.shape
+    if (h, w) == (height, width):
+        return grey.astype(numpy.float32)
+
+    def axis(new, old):
+        position = numpy.clip((numpy.arange(new) + 0.5) * old / float(new) - 0.5, 0, old - 1)
+        low = position.astype(numpy.intp)
+        return low, numpy.minimum(low + 1, old - 1), (position - low).astype(numpy.float32)
+
+    y0, y1, wy = axis(height, h)
+    x0, x1, wx = axis(width, w)
+    top, bottom = grey[y0], grey[y1]
+    top = top[:, x0] * (1 - wx) + top[:, x1] * wx
+    bottom = bottom[:, x0] * (1 - wx) + bottom[:, x1] * wx
+    return (top * (1 - wy)[:, None] + bottom * wy[:, None]).astype(numpy.float32)
+
+
+def threshold(grey, level=128):
+    '''Threshold a grey image.
+
+    Args:
+        grey: 2D float array.
+        level: grey levels below this are printed.
+    Returns:
+        A 2D numpy bool array, True where a dot is printed.
+    Raises:
+        None
+    '''
+    return grey < level
+
+
+def dither(grey, method='floyd-steinberg'):
+    '''Error diffusion dither a grey image.
+
+    Args:
+        grey: 2D float array.
+        method: 'floyd-steinberg' or 'atkinson'.
+    Returns:
+        A 2D numpy bool array, True where a dot is printed.
+    Raises:
+        RuntimeError: Invalid dithering method.
+    '''
+    if method not in kernels:
+        raise RuntimeError('Invalid dithering method.')
+    kernel = kernels[method]
+    h, w = grey.shape
+    # One column of padding on the left, two on the right and two rows below take
+    # the error diffused off the edges.
+    buf = numpy.zeros((h + 2, w + 3), dtype=numpy.float32)
+    buf[:h, 1:w + 1] = grey
+    out = numpy.zeros((h, w), dtype=numpy.bool_)
+    rows = numpy.arange(h)
+    for t in range(w + 2 * (h - 1)):
+        ys = rows[max(0, (t - w + 2) // 2):min(h - 1, t // 2) + 1]
+        xs = t - 2 * ys
+        old = buf[ys, xs + 1]
+        dark = old < 128
+        out[ys, xs] = dark
+        error = old - numpy.where(dark, 0, 255)
+        for dy, dx, weight in kernel:
+            buf[ys + dy, xs + 1 + dx] += error * weight
+    return out
+
+
+def preprocess(image, width=None, rotate=False, method='floyd-steinberg', level=128, key=None):
+    '''Prepare an image for raster printing.
+
+    Args:
+        image: a PIL image or a NumPy array, see to_grey.
+        width: width to resize to, in dots, e.g. the printable width of the tape.
+            The aspect ratio is kept. None leaves the size alone.
+        rotate: turn the image 90 degrees clockwise first, to match labels printed
+            with rotated_printing('rotate').
+        method: 'threshold', 'floyd-steinberg' or 'atkinson'.
+        level: threshold level, for method 'threshold'.
+        key: optional cache key identifying the source image, saving the cost of
+            hashing it on every call.
+    Returns:
+        A read only 2D numpy bool array, True where a dot is printed. It is shared
+        with the cache and must not be modified.
+    Raises:
+        RuntimeError: Invalid dithering method.
+        RuntimeError: Unsupported image.
+    '''
+    if method not in methods:
+        raise RuntimeError('Invalid dithering method.')
+    grey = None
+    if key is None:
+        grey = to_grey(image)
+        key = fingerprint(grey)
+
+    def build():
+        source = to_grey(image) if grey is None else grey
+        if rotate:
+            source = numpy.rot90(source, -1)
+        if width is not None and width != source.shape[1]:
+            source = resize(source, width)
+        if method == 'threshold':
+            bitmap = threshold(source, level)
+        else:
+            bitmap = dither(source, method)
+        bitmap.setflags(write=False)
+        return bitmap
+    return image_cache.get_or_create((key, width, bool(rotate), method, level), build)
+
+
+def split_colors(image, level=128, saturation=80):
+    '''Split a colour image into the black and red planes of two-colour tape.
+
+    Every pixel is classified at once: pixels whose red channel stands out from green
+    and blue by at least saturation are red, other pixels darker than level are black.
+
+    Args:
+        image: a PIL image or an RGB(A) NumPy array. Greyscale input has no red plane.
+        level: grey levels below this are printed black.
+        saturation: how far red must exceed both green and blue for a red dot.
+    Returns:
+        A (black, red) tuple of 2D numpy bool arrays, True where a dot is printed.
+        A dot is never set in both.
+    Raises:
+        RuntimeError: Unsupported image.
+    '''
+    if hasattr(image, 'convert') and hasattr(image, 'mode'):
+        image = image.convert('RGB')
+    rgb = numpy.asarray(image)
+    if rgb.ndim == 2 or rgb.dtype == numpy.bool_:
+        black = threshold(to_grey(rgb), level)
+        return black, numpy.zeros_like(black)
+    if rgb.ndim != 3:
+        raise RuntimeError('Unsupported image.')
+    rgb = rgb[:, :, :3].astype(numpy.int16)
+    red = rgb[:, :, 0] - numpy.maximum(rgb[:, :, 1], rgb[:, :, 2]) >= saturation
+    black = ~red & threshold(to_grey(rgb), level)
+    return black, red
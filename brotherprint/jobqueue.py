@@ -0,0 +1,259 @@
+'''Per Printer Priority Queue
+
+Description:
+Queues print jobs for one printer and sends them one label at a time, so an urgent label
+goes out at the next label boundary instead of waiting behind a long batch. A job is a
+sequence of labels (each ending with print_page, template_print or a raster print
+command), optionally preceded by a mode header such as template mode and template_init.
+The header is sent again whenever the job resumes after another job's labels, so a
+preempted job finds the printer back in its mode. split_labels separates the header
+from the labels of a compiled stream.
+
+Jobs are ordered by priority first. Between jobs of equal priority the fairness setting
+decides: 'fifo' finishes each job before the next one starts, 'fair' interleaves the
+labels of different submitters in proportion to their weights (start time fair queueing),
+so one submitter's 5,000 label batch does not hold up everybody else.
+'''
+import heapq
+import itertools
+import threading
+
+from .decoder import Decoder
+
+
+URGENT = 0
+NORMAL = 5
+BULK = 9
+
+# Commands that end a label.
+label_ends = ('page_feed', 'template_print', 'print', 'print_feed')
+
+# Commands that set the printer up for a job rather than print a label.
+setup_commands = ('invalidate', 'initialize', 'mode', 'template_init')
+
+
+def split_labels(data, mode='escp'):
+    '''Split a compiled command stream at label boundaries.
+
+    Args:
+        data: the stream, bytes or a str of byte values.
+        mode: printer mode at the start of the stream.
+    Returns:
+        A (header, labels) tuple. header is the bytes of the initialize, invalidate,
+        mode switch and template_init commands the stream starts with, for
+        PrintQueue.submit. A template mode header ends with ^CN001, since the printer
+        keeps the copy count of whatever label it printed last: labels that give no
+        count of their own print one copy. labels is a list of bytes, one entry per label. Anything
+        after the last label end is returned as a final entry.
+    Raises:
+        RuntimeError: Invalid mode.
+    '''
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    decoder = Decoder(mode)
+    labels = []
+    start = 0
+    header = None
+    for command in decoder.feed(data) + decoder.close():
+        if header is None:
+            # Before raster mode is entered the invalidate nulls are read as text.
+            if command.name in setup_commands or (command.name == 'text' and
+                                                  not command.data.strip(b'\x00')):
+                continue
+            header = data[:command.offset]
+            if command.mode == 'template':
+                header += b'^CN001'
+            start = command.offset
+        if command.name in label_ends:
+            stop = command.offset + command.size
+            labels.append(data[start:stop])
+            start = stop
+    if header is None:
+        header = data
+        start = len(data)
+    if start < len(data):
+        labels.append(data[start:])
+    return header, labels
+
+
+class Ticket:
+    '''A queued job.
+
+    Attributes:
+        id: submission number.
+        submitter: who submitted the job.
+        priority: the job priority, lower is more urgent.
+        sent: number of labels sent so far.
+        error: the send error that ended the job, or None.
+        done: threading.Event set once every label is sent or the job failed.
+    '''
+
+    def __init__(self, id, labels, header, priority, submitter):
+        self.id = id
+        self.labels = iter(labels)
+        self.header = header
+        self.priority = priority
+        self.submitter = submitter
+        self.sent = 0
+        self.error = None
+        self.done = threading.Event()
+
+
+class PrintQueue:
+    '''Priority queue feeding one printer from a background thread.'''
+
+    def __init__(self, send, fairness='fair', weights=None):
+        '''Set up a queue.
+
+        Args:
+            send: called with the bytes of each label, e.g. the send method of a
+            BrotherPrint or a connected socket's sendall.
+            fairness: 'fifo' or 'fair', see the module description.
+            weights: dict of submitter to relative share for 'fair', default 1.
+        Raises:
+            RuntimeError: Invalid fairness.
+        '''
+        if fairness not in ('fifo', 'fair'):
+            raise RuntimeError('Invalid fairness.')
+        self.send = send
+        self.fairness = fairness
+        self.weights = weights or {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.clock = 0.0
+        self.finish = {}
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+        # The ticket whose label was sent last, None after a failed send.
+        self.last = None
+
+    def submit(self, labels, priority=NORMAL, submitter=None, header=b''):
+        '''Queue a job.
+
+        Args:
+            labels: iterable of labels, each bytes or a str of byte values. May be a
+            generator, labels are only pulled when they are about to be sent.
+            priority: lower is more urgent, e.g. URGENT, NORMAL or BULK.
+            submitter: any hashable naming the submitter, for fair queueing.
+            header: sent before the job's next label whenever the previous label sent
+            came from another job, e.g. the header split_labels returns.
+        Returns:
+            The Ticket.
+        Raises:
+            RuntimeError: The queue is stopped.
+        '''
+        if isinstance(header, str):
+            header = header.encode('latin-1')
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError('The queue is stopped.')
+            ticket = Ticket(next(self.counter), labels, header, priority, submitter)
+            self._push(ticket)
+            self.condition.notify()
+        return ticket
+
+    def _push(self, ticket):
+        if self.fairness == 'fifo':
+            key = ticket.id
+        else:
+            # Start time fair queueing: each label advances its submitter's virtual
+            # finish time by 1/weight, from no earlier than the queue's clock.
+            start = max(self.clock, self.finish.get(ticket.submitter, 0.0))
+            key = start + 1.0 / self.weights.get(ticket.submitter, 1)
+            self.finish[ticket.submitter] = key
+        heapq.heappush(self.heap, (ticket.priority, key, next(self.counter), ticket))
+
+    def pending(self):
+        '''Number of jobs not finished yet.
+
+        Args:
+            None
+        Returns:
+            int
+        Raises:
+            None
+        '''
+        with self.condition:
+            return len(self.heap)
+
+    def _next(self):
+        with self.condition:
+            while not self.heap and not self.stopped:
+                self.condition.wait()
+            if not self.heap:
+                return None
+            priority, key, _, ticket = heapq.heappop(self.heap)
+            if self.fairness == 'fair':
+                self.clock = max(self.clock, key - 1.0 / self.weights.get(ticket.submitter, 1))
+            return ticket
+
+    def run(self):
+        '''Send labels until stopped and empty. Runs in the queue's thread after start.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        while True:
+            ticket = self._next()
+            if ticket is None:
+                break
+            try:
+                label = next(ticket.labels)
+            except StopIteration:
+                ticket.done.set()
+                continue
+            except Exception as e:
+                # A failing label generator ends its own job only.
+                ticket.error = e
+                ticket.done.set()
+                continue
+            if isinstance(label, str):
+                label = label.encode('latin-1')
+            try:
+                if ticket.header and ticket is not self.last:
+                    self.send(ticket.header)
+                self.last = ticket
+                self.send(label)
+            except Exception as e:
+                ticket.error = e
+                self.last = None
+                ticket.done.set()
+                continue
+            ticket.sent += 1
+            with self.condition:
+                self._push(ticket)
+
+    def start(self):
+        '''Start sending in a background thread.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        self.thread = threading.Thread(target=self.run, name='brotherprint-queue')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, wait=True):
+        '''Stop accepting jobs. Queued jobs are still sent.
+
+        Args:
+            wait: block until every queued job is finished.
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if wait and self.thread is not None:
+            self.thread.join()
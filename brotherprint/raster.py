@@ -0,0 +1,405 @@
+'''Brother QL Raster Jobs
+
+Description:
+Builds raster mode print jobs from 1-bit images. A job is a list of pages, each kept as
+packed raster lines (one bit per head dot), and compiles to the complete byte stream:
+invalidate, initialize, raster mode, then for every page the print information, mode
+settings, the raster lines and a print command.
+
+Raster lines are sent mirrored, with the label content placed at the media offset on the
+print head. With compression on, lines are TIFF PackBits encoded and blank lines are
+sent as a single 'Z'. PackBits never makes a line longer than its all-literal form, one
+header byte per 128 bytes, so dense lines cost at most that.
+
+Compression is set per page. With compress='auto' a sample of each page's lines is
+encoded to estimate the bytes saved and the CPU time spent, and the page is compressed
+only if the saving beats the encoding time at the printer's link rate (as measured by
+the transport, see Transport.throughput), or, with no rate known, if it saves bytes.
+
+Two-colour jobs (black and red DK-22251 tape on the QL-8xx models) keep two planes per
+page and send every raster line as a black and a red plane line, compressed the same way.
+'''
+import re
+import time
+
+import numpy
+
+from .bitimage import to_bitmap
+from .image import split_colors
+
+
+# Print head width in dots of the 62mm (QL-5xx/7xx/8xx) and 102mm (QL-10xx) models.
+HEAD_WIDTH = 720
+WIDE_HEAD_WIDTH = 1296
+
+INVALIDATE = b'\x00' * 200
+
+# Continuous tape width in mm: (printable dots, dots from the right edge of the head)
+continuous_media = {12: (106, 29),
+                    29: (306, 6),
+                    38: (413, 12),
+                    50: (554, 12),
+                    54: (590, 0),
+                    62: (696, 12),
+                    102: (1164, 12)}
+
+media_types = {'continuous': 0x0a,
+               'die-cut': 0x0b}
+
+BLACK = 0x01
+RED = 0x02
+
+# Lines encoded per page to decide compression for compress='auto'.
+SAMPLE_LINES = 64
+
+_runs = re.compile(b'(.)\\1{2,}', re.S)
+
+
+def packbits(data):
+    '''TIFF PackBits encode a raster line.
+
+    Args:
+        data: the raw line bytes.
+    Returns:
+        The encoded bytes.
+    Raises:
+        None
+    '''
+    out = bytearray()
+    literal = 0
+    # Runs of 3 or more repeated bytes are found by the regex engine, the bytes
+    # between them are written as literals of up to 128 bytes.
+    for run in _runs.finditer(data):
+        start, stop = run.span()
+        for chunk in range(literal, start, 128):
+            literal_bytes = data[chunk:min(chunk + 128, start)]
+            out.append(len(literal_bytes) - 1)
+            out += literal_bytes
+        value = data[start]
+        while stop - start >= 3:
+            length = min(stop - start, 128)
+            out.append(257 - length)
+            out.append(value)
+            start += length
+        literal = start
+    for chunk in range(literal, len(data), 128):
+        literal_bytes = data[chunk:chunk + 128]
+        out.append(len(literal_bytes) - 1)
+        out += literal_bytes
+    return bytes(out)
+
+
+def encode_line(line, compress=True, color=None):
+    '''Build the raster command for one packed line.
+
+    Args:
+        line: the packed line bytes, one bit per head dot.
+        compress: PackBits encode the line, as set by the compression command.
+        color: BLACK or RED for a plane line of a two-colour job, None for monochrome.
+    Returns:
+        The 'g' raster line command, 'w' for a two-colour plane line, or 'Z' for a
+        blank compressed monochrome line.
+    Raises:
+        None
+    '''
+    if compress:
+        if color is None and not line.strip(b'\x00'):
+            return b'Z'
+        line = packbits(line)
+    if color is None:
+        return b'g\x00' + bytes((len(line),)) + line
+    return b'w' + bytes((color, len(line))) + line
+
+
+def pack_page(image, head_width=HEAD_WIDTH, right_margin=0):
+    '''Lay an image out on the print head and pack it into raster lines.
+
+    Args:
+        image: a PIL image or NumPy array, see bitimage.to_bitmap. Rows run along
+            the tape, columns across it.
+        head_width: print head width in dots.
+        right_margin: dots between the right edge of the head and the media.
+    Returns:
+        A 2D numpy uint8 array, one row of head_width/8 bytes per raster line.
+    Raises:
+        RuntimeError: Image too wide.
+    '''
+    bitmap = to_bitmap(image)
+    height, width = bitmap.shape
+    if width + right_margin > head_width:
+        raise RuntimeError('Image too wide.')
+    head = numpy.zeros((height, head_width), dtype=numpy.bool_)
+    # The head prints the line mirrored.
+    head[:, right_margin:right_margin + width] = bitmap[:, ::-1]
+    return numpy.packbits(head, axis=1)
+
+
+def pack_two_color_page(image, head_width=HEAD_WIDTH, right_margin=0):
+    '''Lay a two-colour image out on the print head and pack both planes.
+
+    Args:
+        image: a (black, red) tuple of images, or a colour image to split with
+            image.split_colors.
+        head_width: print head width in dots.
+        right_margin: dots between the right edge of the head and the media.
+    Returns:
+        A 3D numpy uint8 array of shape (lines, 2, head_width/8), black plane first.
+    Raises:
+        RuntimeError: Image too wide.
+        RuntimeError: The planes differ in size.
+    '''
+    if isinstance(image, tuple):
+        black, red = image
+    else:
+        black, red = split_colors(image)
+    black = pack_page(black, head_width, right_margin)
+    red = pack_page(red, head_width, right_margin)
+    if black.shape != red.shape:
+        raise RuntimeError('The planes differ in size.')
+    return numpy.stack((black, red), axis=1)
+
+
+class RasterJob:
+    '''A raster mode print job.
+
+    Attributes:
+        pages: list of packed pages, see pack_page and pack_two_color_page.
+        cuts: for each page, whether it is cut automatically, or None for auto_cut.
+    '''
+
+    def __init__(self, media_width=62, media_length=0, media_type='continuous', head_width=None,
+                 right_margin=None, compress=True, auto_cut=True, cut_every=1, cut_at_end=True,
+                 high_resolution=False, margin=None, two_color=False):
+        '''Set up a job.
+
+        Args:
+            media_width: tape width in mm.
+            media_length: label length in mm, 0 for continuous tape.
+            media_type: 'continuous' or 'die-cut'.
+            head_width: print head width in dots. Defaults to 1296 for 102mm tape, else 720.
+            right_margin: dots between the right edge of the head and the media. Defaults
+            to the value for the continuous tape width.
+            compress: PackBits compress the raster lines: True, False, or 'auto' to
+            decide per page, see the module description.
+            auto_cut: cut automatically, every cut_every pages.
+            cut_every: number of pages between automatic cuts, 1 to 255.
+            cut_at_end: cut after the last page.
+            high_resolution: print at 600 dpi along the tape.
+            margin: feed before and after each page, in dots. Defaults to 35 for
+            continuous tape and 0 for die-cut labels.
+            two_color: print black and red on two-colour tape.
+        Raises:
+            RuntimeError: Invalid media type.
+            RuntimeError: Invalid cut setting.
+        '''
+        if media_type not in media_types:
+            raise RuntimeError('Invalid media type.')
+        if not 1 <= cut_every <= 255:
+            raise RuntimeError('Invalid cut setting.')
+        if head_width is None:
+            head_width = WIDE_HEAD_WIDTH if media_width > 62 else HEAD_WIDTH
+        if right_margin is None:
+            right_margin = continuous_media.get(media_width, (0, 0))[1]
+        if margin is None:
+            margin = 35 if media_type == 'continuous' else 0
+        self.media_width = media_width
+        self.media_length = media_length
+        self.media_type = media_type
+        self.head_width = head_width
+        self.right_margin = right_margin
+        self.compress = compress
+        self.auto_cut = auto_cut
+        self.cut_every = cut_every
+        self.cut_at_end = cut_at_end
+        self.high_resolution = high_resolution
+        self.margin = margin
+        self.two_color = two_color
+        self.pages = []
+        self.cuts = []
+
+    def pack(self, image):
+        '''Lay an image out on the print head the way this job prints it.
+
+        Args:
+            image: see add_page.
+        Returns:
+            The packed page, see pack_page and pack_two_color_page.
+        Raises:
+            RuntimeError: Image too wide.
+        '''
+        if self.two_color:
+            return pack_two_color_page(image, self.head_width, self.right_margin)
+        return pack_page(image, self.head_width, self.right_margin)
+
+    def add_page(self, image, cut=None):
+        '''Append a page.
+
+        Args:
+            image: a PIL image or NumPy array, see pack_page. For two-colour jobs a
+            colour image or a (black, red) tuple, see pack_two_color_page.
+            cut: True to cut after this page, False not to, None for the job's
+            auto_cut and cut_every setting.
+        Returns:
+            None
+        Raises:
+            RuntimeError: Image too wide.
+        '''
+        self.pages.append(self.pack(image))
+        self.cuts.append(cut)
+
+    def page_header(self, index, lines, compress=None, cut=None):
+        '''Build the commands sent before the raster lines of a page.
+
+        Args:
+            index: page number within the job.
+            lines: number of raster lines on the page.
+            compress: whether the page's lines are compressed, default the job setting.
+            cut: whether to cut after the page, default the job's auto_cut setting.
+        Returns:
+            bytes
+        Raises:
+            None
+        '''
+        flags = 0x86 if self.media_type == 'continuous' else 0x8e
+        header = (b'\x1biz' + bytes((flags, media_types[self.media_type], self.media_width,
+                                     self.media_length)) +
+                  lines.to_bytes(4, 'little') + bytes((0 if index == 0 else 1, 0)))
+        auto_cut = self.auto_cut if cut is None else cut
+        header += b'\x1biM' + bytes((0x40 if auto_cut else 0,))
+        if auto_cut:
+            header += b'\x1biA' + bytes((self.cut_every if cut is None else 1,))
+        expanded = ((0x01 if self.two_color else 0) | (0x08 if self.cut_at_end else 0) |
+                    (0x40 if self.high_resolution else 0))
+        header += b'\x1biK' + bytes((expanded,))
+        header += b'\x1bid' + self.margin.to_bytes(2, 'little')
+        if compress is None:
+            compress = self.compress
+        header += b'M' + (b'\x02' if compress else b'\x00')
+        return header
+
+    def choose_compression(self, page, copies=1, link_rate=None):
+        '''Decide whether to compress a page.
+
+        Args:
+            page: a packed page, or the first run of lines of one.
+            copies: number of times the page is sent. It is encoded only once.
+            link_rate: bytes per second to the printer, None if unknown.
+        Returns:
+            True or False. The job setting unless it is 'auto'.
+        Raises:
+            None
+        '''
+        if self.compress != 'auto':
+            return bool(self.compress)
+        if not len(page):
+            return True
+        lines = page.reshape(-1, page.shape[-1])
+        step = max(1, len(lines) // SAMPLE_LINES)
+        sample = lines[::step][:SAMPLE_LINES]
+        color = BLACK if self.two_color else None
+        started = time.perf_counter()
+        compressed = sum(len(encode_line(line.tobytes(), True, color)) for line in sample)
+        elapsed = time.perf_counter() - started
+        raw = len(sample) * (3 + lines.shape[1])
+        scale = len(lines) / float(len(sample))
+        saved = (raw - compressed) * scale * copies
+        if not link_rate:
+            return saved > 0
+        return saved / link_rate > elapsed * scale
+
+    def encode_lines(self, page, compress=None):
+        '''Encode the raster lines of a packed page.
+
+        Args:
+            page: a packed page, or a run of consecutive lines of one.
+            compress: whether to compress, default the job setting. Must be given
+            when the job setting is 'auto'.
+        Returns:
+            bytes
+        Raises:
+            None
+        '''
+        if compress is None:
+            compress = self.compress
+        if self.two_color:
+            out = []
+            for black, red in page:
+                out.append(encode_line(black.tobytes(), compress, BLACK))
+                out.append(encode_line(red.tobytes(), compress, RED))
+            return b''.join(out)
+        return b''.join([encode_line(line.tobytes(), compress) for line in page])
+
+    def chunks(self, copies=1, link_rate=None):
+        '''Compile the job into the pieces of the byte stream sent to the printer.
+
+        The raster lines of each page are encoded once, and copies repeat the same
+        bytes objects, so a transport can send them without building the whole stream.
+
+        Args:
+            copies: number of times to print the job.
+            link_rate: bytes per second to the printer, for compress='auto'.
+        Returns:
+            List of bytes.
+        Raises:
+            RuntimeError: The job has no pages.
+        '''
+        if not self.pages:
+            raise RuntimeError('The job has no pages.')
+        compress = [self.choose_compression(page, copies, link_rate) for page in self.pages]
+        lines = [self.encode_lines(page, on) for page, on in zip(self.pages, compress)]
+        out = [INVALIDATE, b'\x1b@\x1bia\x01']
+        last = len(self.pages) * copies - 1
+        for index in range(last + 1):
+            page = index % len(self.pages)
+            out.append(self.page_header(index, len(self.pages[page]), compress[page],
+                                        self.cuts[page]))
+            out.append(lines[page])
+            out.append(b'\x1a' if index == last else b'\x0c')
+        return out
+
+    def compile(self, copies=1, link_rate=None):
+        '''Compile the job into the byte stream sent to the printer.
+
+        Args:
+            copies: number of times to print the job.
+            link_rate: bytes per second to the printer, for compress='auto'.
+        Returns:
+            bytes
+        Raises:
+            RuntimeError: The job has no pages.
+        '''
+        return b''.join(self.chunks(copies, link_rate))
+
+    def stream(self, source, link_rate=None):
+        '''Compile a single page job lazily from a source of image rows.
+
+        Only one chunk of rows is held at a time, so memory stays bounded however long
+        the label is. The pages added with add_page are not used.
+
+        Args:
+            source: an iterable of row chunks, each an image as taken by add_page, with
+            a height attribute giving the total number of rows. See brotherprint.stream.
+            link_rate: bytes per second to the printer, for compress='auto'. The
+            decision is made on the first chunk of rows.
+        Returns:
+            A generator of bytes: the job header, one block of raster lines per chunk
+            of rows, then the print command.
+        Raises:
+            RuntimeError: The source row count does not match its height.
+            RuntimeError: Image too wide.
+        '''
+        compress = None
+        count = 0
+        for rows in source:
+            page = self.pack(rows)
+            if compress is None:
+                compress = self.choose_compression(page, link_rate=link_rate)
+                yield (INVALIDATE + b'\x1b@\x1bia\x01' +
+                       self.page_header(0, source.height, compress))
+            count += len(page)
+            yield self.encode_lines(page, compress)
+        if compress is None:
+            yield INVALIDATE + b'\x1b@\x1bia\x01' + self.page_header(0, source.height)
+        if count != source.height:
+            raise RuntimeError('The source row count does not match its height.')
+        yield b'\x1a'
@@ -0,0 +1,429 @@
+'''Record and Replay
+
+Description:
+Captures what goes over the wire to each printer so production traffic can be replayed
+against changes. A RecordingTransport sits between BrotherPrint and the real transport
+and tees every send and label end (flush) to a Recorder, which appends them to a compact
+binary log. The replay tool pushes a log to printers, or to a local emulator that
+accepts and discards the data, at the recorded pace, N times faster or as fast as
+possible, and reports throughput and label latency percentiles.
+
+Log format: the magic b'BPRL1\\n', then records of a header struct '<BHdI' (kind,
+printer id, time.time() timestamp, payload length) followed by the payload. A NAME
+record introduces each printer id with its utf-8 name. The sends of a label are
+buffered per printer and written as one FLUSH record, carrying the label's bytes and
+the time of its first send, when the label ends. DATA records carry the bytes of a
+label too long to buffer, or left unfinished when the recorder closed.
+
+Usage:
+    python -m brotherprint.replay traffic.log --emulate --speed 10
+    python -m brotherprint.replay traffic.log --printer shipping=10.0.0.5:9100 --max
+'''
+import argparse
+import io
+import math
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+
+from .transport import as_transport, connect_socket
+
+
+MAGIC = b'BPRL1\n'
+RECORD = struct.Struct('<BHdI')
+
+# Most bytes of a label buffered before they are written as a DATA record.
+MAX_PENDING = 1 << 20
+
+NAME = 0
+DATA = 1
+FLUSH = 2
+
+Record = namedtuple('Record', ['kind', 'printer', 'time', 'data'])
+
+Report = namedtuple('Report', ['labels', 'bytes', 'elapsed', 'labels_per_second',
+                               'bytes_per_second', 'p50', 'p95', 'p99', 'errors'])
+
+
+class Recorder:
+    '''Appends sends to a binary log. Safe to share between threads and printers.'''
+
+    def __init__(self, path):
+        '''Open a log for writing, replacing any existing file.
+
+        Args:
+            path: the log file name.
+        Raises:
+            OSError: The file could not be created.
+        '''
+        self.file = io.open(path, 'wb')
+        self.file.write(MAGIC)
+        self.printers = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def _write(self, kind, id, timestamp, data):
+        self.file.write(RECORD.pack(kind, id, timestamp, len(data)))
+        self.file.write(data)
+
+    def record(self, printer, kind, data=b''):
+        '''Record a send or the end of a label.
+
+        Args:
+            printer: the printer name.
+            kind: DATA or FLUSH.
+            data: bytes, or a str of byte values as built by BrotherPrint.
+        Returns:
+            None
+        Raises:
+            OSError: The write failed.
+        '''
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        now = time.time()
+        with self.lock:
+            id = self.printers.get(printer)
+            if id is None:
+                id = self.printers[printer] = len(self.printers)
+                self._write(NAME, id, now, printer.encode('utf-8'))
+            pending = self.pending.get(id)
+            if data:
+                if pending is None:
+                    pending = self.pending[id] = [now, 0, []]
+                pending[1] += len(data)
+                pending[2].append(data)
+            if pending is None:
+                # A flush with nothing sent since the last one is not a label.
+                return
+            if kind == FLUSH:
+                self._write(FLUSH, id, pending[0], b''.join(pending[2]))
+                del self.pending[id]
+            elif pending[1] >= MAX_PENDING:
+                self._write(DATA, id, pending[0], b''.join(pending[2]))
+                del self.pending[id]
+
+    def transport(self, printer, inner=None):
+        '''A RecordingTransport logging under a printer name.
+
+        Args:
+            printer: the printer name.
+            inner: the transport, socket or file like object the data goes on to, or
+            None to only record.
+        Returns:
+            A RecordingTransport.
+        Raises:
+            None
+        '''
+        return RecordingTransport(self, printer, inner)
+
+    def close(self):
+        with self.lock:
+            for id, (timestamp, size, chunks) in self.pending.items():
+                self._write(DATA, id, timestamp, b''.join(chunks))
+            self.pending = {}
+            self.file.close()
+
+
+class RecordingTransport:
+    '''Records everything sent, then passes it on. Pass it to BrotherPrint as fsocket.
+
+    Attributes:
+        recorder: the Recorder.
+        printer: the printer name records are logged under.
+        inner: where the data goes on to, or None.
+    '''
+
+    def __init__(self, recorder, printer, inner=None):
+        self.recorder = recorder
+        self.printer = printer
+        self.inner = as_transport(inner) if inner is not None else None
+
+    def send(self, data):
+        self.recorder.record(self.printer, DATA, data)
+        if self.inner is not None:
+            self.inner.send(data)
+
+    def flush(self):
+        self.recorder.record(self.printer, FLUSH)
+        if self.inner is not None and hasattr(self.inner, 'flush'):
+            self.inner.flush()
+
+    def close(self):
+        if self.inner is not None and hasattr(self.inner, 'close'):
+            self.inner.close()
+
+
+def read_log(path):
+    '''Read a log.
+
+    Args:
+        path: the log file name.
+    Returns:
+        A generator of Records with the printer given by name. A record cut short by
+        a crash while recording ends the log.
+    Raises:
+        RuntimeError: Not a replay log.
+    '''
+    names = {}
+    with io.open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError('Not a replay log.')
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            kind, id, timestamp, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind == NAME:
+                names[id] = data.decode('utf-8')
+            else:
+                yield Record(kind, names.get(id, str(id)), timestamp, data)
+
+
+def percentile(values, p):
+    '''Nearest rank percentile.
+
+    Args:
+        values: sorted list of numbers.
+        p: the percentile, 0 to 100.
+    Returns:
+        The value, or 0.0 for an empty list.
+    Raises:
+        None
+    '''
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def parse_address(text, port=9100):
+    host, _, number = text.rpartition(':')
+    if not host:
+        return text, port
+    return host, int(number)
+
+
+class _Player(threading.Thread):
+    # Replays the labels of one printer over one connection.
+
+    def __init__(self, address, labels, connect, start, speed):
+        threading.Thread.__init__(self, name='brotherprint-replay')
+        self.daemon = True
+        self.address = address
+        self.labels = labels
+        self.connect = connect
+        self.start_time = start
+        self.speed = speed
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+
+    def run(self):
+        connection = None
+        for offset, chunks in self.labels:
+            due = self.start_time + offset / self.speed if self.speed else time.time()
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                if connection is None:
+                    connection = self.connect(self.address)
+                for chunk in chunks:
+                    connection.send(chunk)
+                if hasattr(connection, 'flush'):
+                    connection.flush()
+            except (socket.error, OSError):
+                self.errors += 1
+                connection = None
+                continue
+            # Latency counts from when the label was due, so falling behind shows.
+            self.latencies.append(time.time() - due)
+            self.bytes += sum(len(chunk) for chunk in chunks)
+        if connection is not None:
+            connection.close()
+
+
+def replay(path, targets, speed=1.0, connect=connect_socket):
+    '''Replay a log.
+
+    Args:
+        path: the log file name.
+        targets: dict of printer name to (host, port), or a single (host, port) every
+        printer's traffic is sent to, each printer over its own connection.
+        speed: 1 for the recorded pace, N for N times faster, 0 for as fast as possible.
+        connect: called with an address, returns an object with send(bytes) and close().
+    Returns:
+        A Report. Latencies are in seconds, from when a label was due to when it was
+        sent.
+    Raises:
+        RuntimeError: Not a replay log.
+        RuntimeError: No target for printer.
+    '''
+    labels = {}
+    pending = {}
+    # Labels are logged when they end, so the earliest start is not always first.
+    records = list(read_log(path))
+    first = min(record.time for record in records) if records else 0.0
+    for record in records:
+        label = pending.get(record.printer)
+        if label is None:
+            label = pending[record.printer] = (record.time - first, [])
+        if record.data:
+            label[1].append(record.data)
+        if record.kind == FLUSH:
+            labels.setdefault(record.printer, []).append(label)
+            del pending[record.printer]
+    for printer, label in pending.items():
+        if label[1]:
+            labels.setdefault(printer, []).append(label)
+
+    players = []
+    start = time.time()
+    for printer, printer_labels in labels.items():
+        if isinstance(targets, dict):
+            if printer not in targets:
+                raise RuntimeError('No target for printer.')
+            address = targets[printer]
+        else:
+            address = targets
+        players.append(_Player(address, printer_labels, connect, start, speed))
+    for player in players:
+        player.start()
+    for player in players:
+        player.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for player in players for latency in player.latencies)
+    total = sum(player.bytes for player in players)
+    return Report(len(latencies), total, elapsed,
+                  len(latencies) / elapsed if elapsed else 0.0,
+                  total / elapsed if elapsed else 0.0,
+                  percentile(latencies, 50), percentile(latencies, 95),
+                  percentile(latencies, 99), sum(player.errors for player in players))
+
+
+class _Server(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Emulator:
+    '''A local stand-in for printers: accepts raw print connections and discards the data.
+
+    Attributes:
+        bytes_received: total bytes read.
+        rate: bytes per second each connection reads at, None for unlimited.
+        buffer_size: socket receive buffer in bytes, None for the system default. Printers
+        have small input buffers; a small buffer makes a rate limited link behave alike.
+    '''
+
+    def __init__(self, address=('127.0.0.1', 0), rate=None, buffer_size=None):
+        self.address = address
+        self.rate = rate
+        self.buffer_size = buffer_size
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        '''Start listening in a background thread.
+
+        Args:
+            None
+        Returns:
+            The (host, port) the emulator listens on.
+        Raises:
+            socket.error: The address is in use.
+        '''
+        emulator = self
+
+        class Handler(BaseRequestHandler):
+
+            def handle(self):
+                if emulator.buffer_size:
+                    self.request.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                            emulator.buffer_size)
+                # Read about 100 times a second when rate limited, so the link drains evenly.
+                size = int(min(65536, max(1024, emulator.rate / 100))) if emulator.rate else 65536
+                due = time.time()
+                while True:
+                    data = self.request.recv(size)
+                    if not data:
+                        break
+                    with emulator.lock:
+                        emulator.bytes_received += len(data)
+                    if emulator.rate:
+                        due = max(due, time.time() - 0.1) + len(data) / float(emulator.rate)
+                        delay = due - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+
+        self.server = _Server(self.address, Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name='brotherprint-emulator')
+        thread.daemon = True
+        thread.start()
+        return self.server.server_address
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m brotherprint.replay',
+                                     description='Replay recorded print traffic.')
+    parser.add_argument('log', help='log written by a Recorder')
+    parser.add_argument('--printer', action='append', default=[], metavar='NAME=HOST[:PORT]',
+                        help='where to send a recorded printer\'s traffic')
+    parser.add_argument('--target', metavar='HOST[:PORT]',
+                        help='send every printer\'s traffic to one address')
+    parser.add_argument('--emulate', action='store_true',
+                        help='send to a local emulator that discards the data')
+    parser.add_argument('--rate', type=float, help='emulator link speed in bytes per second')
+    parser.add_argument('--speed', type=float, default=1.0, help='N times the recorded pace')
+    parser.add_argument('--max', action='store_true', help='send as fast as possible')
+    args = parser.parse_args(argv)
+
+    emulator = None
+    if args.emulate:
+        emulator = Emulator(rate=args.rate)
+        targets = emulator.start()
+    elif args.target:
+        targets = parse_address(args.target)
+    elif args.printer:
+        targets = {}
+        for entry in args.printer:
+            name, _, address = entry.partition('=')
+            targets[name] = parse_address(address)
+    else:
+        parser.error('give --printer, --target or --emulate')
+    try:
+        report = replay(args.log, targets, speed=0 if args.max else args.speed)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        if emulator is not None:
+            emulator.stop()
+    print('labels      %d (%d failed)' % (report.labels, report.errors))
+    print('bytes       %d' % report.bytes)
+    print('elapsed     %.3f s' % report.elapsed)
+    print('throughput  %.1f labels/s, %.1f KiB/s' % (report.labels_per_second,
+                                                    report.bytes_per_second / 1024))
+    print('latency     p50 %.2f ms, p95 %.2f ms, p99 %.2f ms' % (report.p50 * 1000,
+                                                             report.p95 * 1000,
+                                                             report.p99 * 1000))
+    return 1 if report.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,501 @@
+'''Sharded Multi-Process Print Service
+
+Description:
+Drives many printers from several worker processes, so raster encoding for one printer
+does not hold the GIL for all the others. The supervisor shards printers across workers
+(each printer always goes to the same worker, keeping its connection and label order),
+and hands each worker its jobs through a single producer, single consumer ring buffer
+in shared memory: length prefixed records, with a semaphore counting records written
+and one signalling space freed. Job payloads are copied into the ring, never pickled.
+
+Jobs are either compiled command streams, sent as they are, or packed raster images,
+which the worker encodes into a raster job itself, compressing where the printer's link
+makes it pay off. Workers report every job's outcome
+over a multiprocessing Queue, and the supervisor keeps job status and per printer
+metrics from those reports.
+
+    service = Service({'shipping': ('10.0.0.5', 9100), 'returns': ('10.0.0.6', 9100)})
+    service.start()
+    job = service.submit('shipping', data)
+    service.wait(job)
+'''
+import itertools
+import multiprocessing
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+from .transport import connect_socket
+
+# Producer and consumer positions, on separate cache lines.
+HEAD = struct.Struct('<Q')
+TAIL_OFFSET = 64
+HEADER_SIZE = 128
+LENGTH = struct.Struct('<I')
+
+# Job record: job id, kind, printer name length. Job id 0 stops the worker.
+JOB = struct.Struct('<QBH')
+RASTER_INFO = struct.Struct('<HHB')
+
+COMPILED = 0
+RASTER = 1
+
+
+class RingBuffer:
+    '''Single producer, single consumer queue of byte records in shared memory.
+
+    Pass it to a multiprocessing.Process as an argument to use it from the child.
+    Only one thread of one process may put and one may get.
+
+    Attributes:
+        capacity: bytes of record space. A record takes its length plus 4 bytes.
+    '''
+
+    def __init__(self, capacity=1 << 24, name=None, items=None, freed=None):
+        '''Create a ring buffer, or attach to one by name.
+
+        Args:
+            capacity: bytes of record space.
+            name: shared memory name to attach to, None to create.
+            items, freed: the buffer's semaphores when attaching.
+        Raises:
+            OSError: The shared memory could not be created or found.
+        '''
+        self.capacity = capacity
+        # Only the creating process frees the memory, also when a forked child has a copy.
+        self.owner = os.getpid() if name is None else None
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+            HEAD.pack_into(self.shm.buf, 0, 0)
+            HEAD.pack_into(self.shm.buf, TAIL_OFFSET, 0)
+            self.items = multiprocessing.Semaphore(0)
+            self.freed = multiprocessing.Semaphore(0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.items = items
+            self.freed = freed
+
+    def __reduce__(self):
+        return (RingBuffer, (self.capacity, self.shm.name, self.items, self.freed))
+
+    def _copy_in(self, position, data):
+        buf = self.shm.buf
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        buf[HEADER_SIZE + start:HEADER_SIZE + start + first] = data[:first]
+        if first < len(data):
+            buf[HEADER_SIZE:HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        buf = self.shm.buf
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(buf[HEADER_SIZE + start:HEADER_SIZE + start + first])
+        if first < size:
+            data += bytes(buf[HEADER_SIZE:HEADER_SIZE + size - first])
+        return data
+
+    def put(self, *parts, alive=None, timeout=None):
+        '''Append one record, waiting for space.
+
+        Args:
+            parts: bytes-like objects, written back to back as a single record.
+            alive: a callable telling whether the consumer is still running, checked
+            while waiting for space.
+            timeout: seconds to wait for space, None to wait forever.
+        Returns:
+            None
+        Raises:
+            RuntimeError: Record too large for the ring buffer.
+            RuntimeError: The consumer stopped.
+            RuntimeError: Timed out waiting for space.
+        '''
+        parts = [memoryview(part).cast('B') for part in parts]
+        size = sum(len(part) for part in parts)
+        if size + LENGTH.size > self.capacity:
+            raise RuntimeError('Record too large for the ring buffer.')
+        deadline = None if timeout is None else time.monotonic() + timeout
+        head = HEAD.unpack_from(self.shm.buf, 0)[0]
+        while head - HEAD.unpack_from(self.shm.buf, TAIL_OFFSET)[0] + size + LENGTH.size > self.capacity:
+            if self.freed.acquire(True, 0.1):
+                continue
+            if alive is not None and not alive():
+                raise RuntimeError('The consumer stopped.')
+            if deadline is not None and time.monotonic() >= deadline:
+                raise RuntimeError('Timed out waiting for space.')
+        self._copy_in(head, LENGTH.pack(size))
+        position = head + LENGTH.size
+        for part in parts:
+            self._copy_in(position, part)
+            position += len(part)
+        HEAD.pack_into(self.shm.buf, 0, position)
+        self.items.release()
+
+    def get(self, timeout=None):
+        '''Take the oldest record.
+
+        Args:
+            timeout: seconds to wait for a record, None to wait forever.
+        Returns:
+            The record as bytes, or None if the timeout passed.
+        Raises:
+            None
+        '''
+        if not self.items.acquire(True, timeout):
+            return None
+        tail = HEAD.unpack_from(self.shm.buf, TAIL_OFFSET)[0]
+        size = LENGTH.unpack(self._copy_out(tail, LENGTH.size))[0]
+        data = self._copy_out(tail + LENGTH.size, size)
+        HEAD.pack_into(self.shm.buf, TAIL_OFFSET, tail + LENGTH.size + size)
+        self.freed.release()
+        return data
+
+    def close(self):
+        '''Detach, and free the shared memory if this process created it.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        self.shm.close()
+        if self.owner == os.getpid():
+            self.shm.unlink()
+
+
+def _compile_raster(record, offset, link_rate):
+    import numpy
+    from .raster import RasterJob
+    width, height, media_width = RASTER_INFO.unpack_from(record, offset)
+    offset += RASTER_INFO.size
+    rows = numpy.frombuffer(record, dtype=numpy.uint8, offset=offset)
+    rows = rows.reshape(height, (width + 7) // 8)
+    job = RasterJob(media_width=media_width, compress='auto')
+    job.add_page(numpy.unpackbits(rows, axis=1, count=width).view(numpy.bool_))
+    return job.compile(link_rate=link_rate)
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except (socket.error, OSError):
+        pass
+
+
+def _worker(index, printers, ring, results, connect):
+    # Worker process main loop: send each job to its printer and report the outcome.
+    connections = {}
+    while True:
+        record = ring.get()
+        job_id, kind, name_size = JOB.unpack_from(record, 0)
+        if job_id == 0:
+            break
+        offset = JOB.size + name_size
+        name = record[JOB.size:offset].decode('utf-8')
+        started = time.time()
+        error = None
+        size = 0
+        try:
+            connection = connections.get(name)
+            if connection is None:
+                connection = connections[name] = connect(printers[name])
+            if kind == RASTER:
+                # Compress only where it pays off on this printer's link.
+                data = _compile_raster(record, offset, getattr(connection, 'throughput', None))
+            else:
+                data = memoryview(record)[offset:]
+            size = len(data)
+            connection.send(data)
+            if hasattr(connection, 'flush'):
+                connection.flush()
+        except Exception as e:
+            # Whatever a job or a custom connection raises fails that job only.
+            error = str(e) or e.__class__.__name__
+            if name in connections:
+                _close(connections.pop(name))
+        results.put(('job', index, job_id, name, error, size, time.time() - started))
+    for connection in connections.values():
+        _close(connection)
+    ring.close()
+    results.put(('exit', index))
+
+
+class Service:
+    '''Supervisor: owns the worker processes, their ring buffers and the job records.
+
+    Attributes:
+        shards: list of dicts of printer name to address, one per worker.
+        metrics: dict of printer name to a dict of 'worker', 'jobs', 'failed', 'bytes',
+        'busy' (seconds spent compiling and sending) and 'status' ('idle', 'ok' or the
+        last error).
+    '''
+
+    def __init__(self, printers, workers=None, capacity=1 << 24, connect=connect_socket,
+                 history=10000):
+        '''Set up a service.
+
+        Args:
+            printers: dict of printer name to (host, port), or to anything connect
+            accepts.
+            workers: number of worker processes, default one per CPU, never more than
+            one per printer.
+            capacity: ring buffer bytes per worker, the largest job it can take.
+            connect: called in the worker with a printer address, returns an object with
+            send(bytes) and close(). Must be picklable, e.g. a module level function.
+            history: number of finished jobs kept for wait and status queries.
+        Raises:
+            RuntimeError: No printers.
+        '''
+        if not printers:
+            raise RuntimeError('No printers.')
+        workers = max(1, min(workers or os.cpu_count() or 1, len(printers)))
+        names = sorted(printers)
+        self.shards = [dict((name, printers[name]) for name in names[i::workers])
+                       for i in range(workers)]
+        self.worker_of = dict((name, i) for i, shard in enumerate(self.shards) for name in shard)
+        self.capacity = capacity
+        self.connect = connect
+        self.history = history
+        self.metrics = dict((name, {'worker': self.worker_of[name], 'jobs': 0, 'failed': 0,
+                                    'bytes': 0, 'busy': 0.0, 'status': 'idle'})
+                            for name in names)
+        self.jobs = OrderedDict()
+        self.events = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.rings = []
+        self.ring_locks = []
+        self.processes = []
+        self.results = None
+        self.collector = None
+
+    def start(self):
+        '''Start the worker processes and the result collector.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            OSError: Shared memory or a process could not be created.
+        '''
+        self.results = multiprocessing.Queue()
+        for index, shard in enumerate(self.shards):
+            ring = RingBuffer(self.capacity)
+            process = multiprocessing.Process(target=_worker, name='brotherprint-worker-%d' % index,
+                                              args=(index, shard, ring, self.results, self.connect))
+            process.daemon = True
+            process.start()
+            self.rings.append(ring)
+            self.ring_locks.append(threading.Lock())
+            self.processes.append(process)
+        self.collector = threading.Thread(target=self._collect, name='brotherprint-collector')
+        self.collector.daemon = True
+        self.collector.start()
+
+    def _collect(self):
+        exited = set()
+        while len(exited) < len(self.processes):
+            try:
+                message = self.results.get(True, 0.5)
+            except queue.Empty:
+                # A dead worker's reports are all in the queue by the time it is seen
+                # dead, so read them before failing what it left unfinished.
+                dead = [index for index, process in enumerate(self.processes)
+                        if index not in exited and not process.is_alive()]
+                self._drain(exited)
+                for index in dead:
+                    if index not in exited:
+                        exited.add(index)
+                        self._fail_shard(index, 'The worker stopped.')
+                continue
+            self._handle(message, exited)
+
+    def _drain(self, exited):
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(message, exited)
+
+    def _fail_shard(self, index, error):
+        events = []
+        with self.lock:
+            for name in self.shards[index]:
+                self.metrics[name]['status'] = error
+            for job in self.jobs.values():
+                if job['status'] == 'queued' and self.worker_of[job['printer']] == index:
+                    job['status'] = 'failed'
+                    job['error'] = error
+                    self.metrics[job['printer']]['failed'] += 1
+                    events.append(self.events.pop(job['id'], None))
+        for event in events:
+            if event is not None:
+                event.set()
+
+    def _handle(self, message, exited):
+        if message[0] == 'exit':
+            exited.add(message[1])
+            return
+        _, index, job_id, name, error, size, busy = message
+        with self.lock:
+            metrics = self.metrics[name]
+            metrics['jobs'] += 1
+            metrics['busy'] += busy
+            if error:
+                metrics['failed'] += 1
+                metrics['status'] = error
+            else:
+                metrics['bytes'] += size
+                metrics['status'] = 'ok'
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['status'] = 'failed' if error else 'sent'
+                job['error'] = error
+            event = self.events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _submit(self, printer, kind, *parts):
+        if printer not in self.worker_of:
+            raise RuntimeError('Unknown printer.')
+        name = printer.encode('utf-8')
+        with self.lock:
+            job_id = next(self.counter)
+            self.jobs[job_id] = {'id': job_id, 'printer': printer, 'status': 'queued', 'error': None}
+            self.events[job_id] = threading.Event()
+            while len(self.jobs) > self.history:
+                oldest = next(iter(self.jobs))
+                if self.jobs[oldest]['status'] == 'queued':
+                    break
+                del self.jobs[oldest]
+        index = self.worker_of[printer]
+        process = self.processes[index]
+        try:
+            if not process.is_alive():
+                raise RuntimeError('The worker stopped.')
+            with self.ring_locks[index]:
+                self.rings[index].put(JOB.pack(job_id, kind, len(name)), name, *parts,
+                                      alive=process.is_alive)
+        except RuntimeError:
+            with self.lock:
+                del self.jobs[job_id]
+                del self.events[job_id]
+            raise
+        return job_id
+
+    def submit(self, printer, data):
+        '''Queue a compiled job.
+
+        Args:
+            printer: the printer name.
+            data: the command stream, bytes or a str of byte values.
+        Returns:
+            The job id.
+        Raises:
+            RuntimeError: Unknown printer.
+            RuntimeError: Record too large for the ring buffer.
+            RuntimeError: The worker stopped.
+        '''
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        return self._submit(printer, COMPILED, data)
+
+    def submit_raster(self, printer, data, width, height, media_width=62):
+        '''Queue a raster image, encoded into a raster job by the printer's worker.
+
+        Args:
+            printer: the printer name.
+            data: packed rows, 1 bit per dot, most significant bit first, each row
+            padded to a whole byte.
+            width, height: image size in dots.
+            media_width: media width in mm, see RasterJob.
+        Returns:
+            The job id.
+        Raises:
+            RuntimeError: Unknown printer.
+            RuntimeError: Invalid image size.
+            RuntimeError: Record too large for the ring buffer.
+            RuntimeError: The worker stopped.
+        '''
+        if len(data) != (width + 7) // 8 * height or not 0 < width < 65536 or not 0 < height < 65536:
+            raise RuntimeError('Invalid image size.')
+        return self._submit(printer, RASTER, RASTER_INFO.pack(width, height, media_width), data)
+
+    def wait(self, job_id, timeout=None):
+        '''Wait for a job to be sent or fail.
+
+        Args:
+            job_id: the id returned by submit.
+            timeout: seconds to wait, None to wait forever.
+        Returns:
+            A dict of 'id', 'printer', 'status' ('queued', 'sent' or 'failed') and
+            'error', or None if the job is unknown or expired.
+        Raises:
+            None
+        '''
+        with self.lock:
+            event = self.events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def status(self):
+        '''Per printer metrics.
+
+        Args:
+            None
+        Returns:
+            A copy of the metrics attribute.
+        Raises:
+            None
+        '''
+        with self.lock:
+            return dict((name, dict(metrics)) for name, metrics in self.metrics.items())
+
+    def stop(self, timeout=None):
+        '''Send what is queued, stop the workers and free the ring buffers.
+
+        Args:
+            timeout: seconds to wait for the workers before terminating them, None to
+            wait until they finish.
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for ring, lock, process in zip(self.rings, self.ring_locks, self.processes):
+            left = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                # A worker stuck on its printer never frees space for the stop record.
+                if not lock.acquire(timeout=-1 if left is None else left):
+                    continue
+                try:
+                    ring.put(JOB.pack(0, COMPILED, 0), alive=process.is_alive, timeout=left)
+                finally:
+                    lock.release()
+            except RuntimeError:
+                pass
+        for process in self.processes:
+            process.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        if self.collector is not None:
+            self.collector.join(timeout)
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+        self.ring_locks = []
+        self.processes = []
@@ -0,0 +1,87 @@
+'''Row Sources for Streaming Raster Jobs
+
+Description:
+Row sources feed RasterJob.stream with an image a chunk of rows at a time, so banners
+meters long are compressed and sent as they are read instead of being built in memory
+first. A source is any iterable of row chunks with a height attribute.
+
+MemmapSource reads a raw bitmap file through a memory map, TiledSource pulls tiles from
+a callable, e.g. one rendering or decoding the image piece by piece.
+'''
+import numpy
+
+
+class MemmapSource:
+    '''Rows of a raw bitmap file, read through a memory map.
+
+    Attributes:
+        width: image width in dots.
+        height: number of rows.
+    '''
+
+    def __init__(self, path, width, height, format='packed', offset=0, rows=256, level=128):
+        '''Open a raw bitmap file.
+
+        Args:
+            path: the file name.
+            width: image width in dots.
+            height: number of rows.
+            format: 'packed' for 1 bit per dot, most significant bit first, every row
+            padded to whole bytes and set bits printed. 'grey' for 1 byte per dot,
+            values below level printed.
+            offset: bytes to skip at the start of the file, e.g. a header.
+            rows: number of rows per chunk.
+            level: threshold for 'grey' files.
+        Raises:
+            RuntimeError: Invalid format.
+        '''
+        if format not in ('packed', 'grey'):
+            raise RuntimeError('Invalid format.')
+        self.path = path
+        self.width = width
+        self.height = height
+        self.format = format
+        self.offset = offset
+        self.rows = rows
+        self.level = level
+
+    def __iter__(self):
+        row_bytes = (self.width + 7) // 8 if self.format == 'packed' else self.width
+        data = numpy.memmap(self.path, dtype=numpy.uint8, mode='r', offset=self.offset,
+                            shape=(self.height, row_bytes))
+        try:
+            for start in range(0, self.height, self.rows):
+                chunk = data[start:start + self.rows]
+                if self.format == 'packed':
+                    yield numpy.unpackbits(chunk, axis=1, count=self.width).view(numpy.bool_)
+                else:
+                    yield chunk < self.level
+        finally:
+            del data
+
+
+class TiledSource:
+    '''Rows produced tile by tile by a callable.
+
+    Attributes:
+        height: number of rows.
+    '''
+
+    def __init__(self, tile, height, tile_height):
+        '''Set up a tiled source.
+
+        Args:
+            tile: called with a tile index (0, 1, ...) and returning that tile as a PIL
+            image or NumPy array, tile_height rows tall except possibly the last one.
+            height: total number of rows.
+            tile_height: rows per tile.
+        Raises:
+            None
+        '''
+        self.tile = tile
+        self.height = height
+        self.tile_height = tile_height
+
+    def __iter__(self):
+        for index in range(-(-self.height // self.tile_height)):
+            yield self.tile(index)
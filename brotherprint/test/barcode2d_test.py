@@ -0,0 +1,96 @@
+import numpy
+import pytest
+
+from brotherprint import BrotherPrint
+from brotherprint.barcode2d import render, symbol_cache, symbol_matrix
+from brotherprint.decoder import decode
+
+
+class Capture:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data.encode('latin-1') if isinstance(data, str) else data
+
+
+def sent(**options):
+    buf = Capture()
+    BrotherPrint(buf).barcode_2d(**options)
+    return bytes(buf.data)
+
+
+def printed_bitmap(data):
+    '''Rebuild the dots of the ESC * bit image commands in a stream.'''
+    bands = []
+    for command in decode(data):
+        if command.name == 'bit_image':
+            rows = 24 if command.params['density'] >= 32 else 8
+            columns = numpy.frombuffer(command.data, dtype=numpy.uint8)
+            columns = columns.reshape(command.params['columns'], rows // 8)
+            bands.append(numpy.unpackbits(columns, axis=1).T.astype(numpy.bool_))
+    return numpy.vstack(bands)
+
+
+def test_native_command_bytes():
+    assert sent(data='abc', format='qr') == b'\x1biQ\x04\x02\x00\x00\x00\x00\x02\x00abc\\\\\\'
+    assert sent(data='abc', format='qr', cell_size=10, error_correction='H', model='micro') == \
+        b'\x1biQ\x0a\x03\x00\x00\x00\x00\x04\x00abc\\\\\\'
+    assert sent(data='abc', format='pdf417', cell_size=2, security_level=5, columns=4, rows=10) == \
+        b'\x1biV\x00\x02\x05\x04\x0aabc\\\\\\'
+    assert sent(data='abc', format='datamatrix', rectangular=True, rows=8, columns=18) == \
+        b'\x1biD\x01\x04\x08\x12abc\\\\\\'
+    assert sent(data='abc', format='maxicode', mode=4) == b'\x1biU\x04abc\\\\\\'
+    command, = decode(sent(data='abc', format='qr'))
+    assert (command.name, command.params['format'], command.data) == ('barcode_2d', 'qr', b'abc')
+
+
+def test_native_qr_cell_sizes():
+    for cell_size in (3, 4, 5, 6, 8, 10):
+        sent(data='abc', format='qr', cell_size=cell_size)
+    for cell_size in (1, 2, 7, 9, 11):
+        with pytest.raises(RuntimeError):
+            sent(data='abc', format='qr', cell_size=cell_size)
+
+
+def test_render_scales_modules():
+    matrix = numpy.array([[True, False], [False, True]])
+    dots = render(matrix, cell_size=2, quiet_zone=1, row_height=3)
+    assert dots.shape == (12, 8)
+    assert dots[3:6, 2:4].all() and not dots[3:6, 4:6].any() and dots[6:9, 4:6].all()
+    assert not dots[:3].any() and not dots[:, :2].any()
+
+
+def test_raster_qr_prints_the_symbol():
+    qrcode = pytest.importorskip('qrcode')
+    symbol = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_Q, border=0)
+    symbol.add_data('https://example.com/label/42')
+    symbol.make(fit=True)
+    expected = numpy.array(symbol.get_matrix(), dtype=numpy.bool_)
+
+    data = sent(data='https://example.com/label/42', format='qr', method='raster', cell_size=3,
+                error_correction='Q')
+    dots = printed_bitmap(data)
+    size = expected.shape[0]
+    # Sample the middle dot of every 3x3 module back into a module matrix.
+    modules = dots[1:size * 3:3, 1:size * 3:3]
+    assert numpy.array_equal(modules, expected)
+    assert not dots[size * 3:].any()
+    # The three finder patterns: a dark 7x7 ring around a 3x3 core.
+    finder = numpy.ones((7, 7), dtype=numpy.bool_)
+    finder[1:6, 1:6] = False
+    finder[2:5, 2:5] = True
+    for top, left in ((0, 0), (0, size - 7), (size - 7, 0)):
+        assert numpy.array_equal(modules[top:top + 7, left:left + 7], finder)
+
+
+def test_symbol_cache_key():
+    pytest.importorskip('qrcode')
+    symbol_cache.clear()
+    first = symbol_matrix('cache me', 'qr', 'M')
+    assert symbol_matrix('cache me', 'qr', 'M') is first
+    assert (symbol_cache.hits, symbol_cache.misses) == (1, 1)
+    assert symbol_matrix('cache me', 'qr', 'H') is not first
+    assert symbol_matrix('cache me!', 'qr', 'M') is not first
+    assert not first.flags.writeable
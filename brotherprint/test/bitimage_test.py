@@ -0,0 +1,38 @@
+import numpy
+import pytest
+
+from brotherprint.bitimage import compile_bit_image, pack_columns
+
+
+def test_band_feed_range():
+    image = numpy.ones((24, 16), dtype=numpy.bool_)
+    assert compile_bit_image(image, band_feed=255).endswith('\r\x1bJ\xff')
+    for band_feed in (-1, 256):
+        with pytest.raises(RuntimeError):
+            compile_bit_image(image, band_feed=band_feed)
+
+
+def test_pack_columns_is_column_major_msb_first():
+    bitmap = numpy.zeros((10, 2), dtype=numpy.bool_)
+    bitmap[0, 0] = bitmap[7, 0] = bitmap[1, 1] = bitmap[9, 1] = True
+    # Bands are padded to whole bands with blank dots.
+    assert pack_columns(bitmap, 8) == [b'\x81\x40', b'\x00\x40']
+    bitmap = numpy.zeros((24, 2), dtype=numpy.bool_)
+    bitmap[0, 0] = bitmap[8, 0] = bitmap[23, 0] = bitmap[15, 1] = True
+    assert pack_columns(bitmap, 24) == [b'\x80\x80\x01\x00\x01\x00']
+
+
+def test_bit_image_header():
+    image = numpy.zeros((8, 300), dtype=numpy.bool_)
+    image[0, 0] = True
+    for density, m in (('8-dot single', 0), ('8-dot double', 1)):
+        compiled = compile_bit_image(image, density=density)
+        assert compiled.startswith('\x1b*' + chr(m) + '\x2c\x01\x80\x00')
+        assert len(compiled) == 5 + 300 + 4
+    image = numpy.zeros((24, 300), dtype=numpy.bool_)
+    image[0, 0] = True
+    for density, m in (('24-dot single', 32), ('24-dot double', 33)):
+        compiled = compile_bit_image(image, density=density)
+        assert compiled.startswith('\x1b*' + chr(m) + '\x2c\x01\x80\x00\x00\x00')
+        assert compiled.endswith('\r\x1bJ\x18')
+        assert len(compiled) == 5 + 3 * 300 + 4
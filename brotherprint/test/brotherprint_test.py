@@ -1 +1,62 @@
-# TODO: Create tests
\ No newline at end of file
+import pytest
+
+from brotherprint import BrotherPrint
+from brotherprint.transport import MemoryTransport
+
+
+def test_print_page_copies_replay_the_page():
+    buf = MemoryTransport()
+    job = BrotherPrint(buf)
+    job.initialize()
+    job.send('hello')
+    job.print_page('full', copies=3)
+    job.send('x')
+    job.print_page('full')
+    page = b'\x1b@hello\x1biC\x01\x0c'
+    assert buf.getvalue() == page * 3 + b'x\x1biC\x01\x0c'
+
+
+def test_template_copies_over_999_resend_fields():
+    buf = MemoryTransport()
+    job = BrotherPrint(buf)
+    job.choose_template('3')
+    job.template_print(1000)
+    assert buf.getvalue() == b'^TS003^CN999^FF^TS003^CN001^FF'
+
+
+def test_template_print_sends_a_count_only_when_given():
+    buf = MemoryTransport()
+    job = BrotherPrint(buf)
+    job.choose_template('3')
+    job.template_print()
+    job.template_print(1)
+    assert buf.getvalue() == b'^TS003^FF^CN001^FF'
+
+
+def test_invalid_copies():
+    job = BrotherPrint(MemoryTransport())
+    for copies in ('2', 0, 2.0, True):
+        with pytest.raises(RuntimeError, match='Invalid copies.'):
+            job.print_page('full', copies=copies)
+        with pytest.raises(RuntimeError, match='Invalid copies.'):
+            job.template_print(copies)
+
+
+def test_label_buffer_is_bounded():
+    job = BrotherPrint(MemoryTransport())
+    job.raster_mode()
+    for _ in range(1000):
+        job.send('x' * 4096)
+    assert job.label is None
+    with pytest.raises(RuntimeError):
+        job.print_page('full', copies=2)
+    job.page_feed()
+    job.send('y')
+    assert job.label == ['y']
+
+
+def test_page_feed_ends_the_label():
+    job = BrotherPrint(MemoryTransport())
+    job.send('abc')
+    job.page_feed()
+    assert job.label == []
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from brotherprint.coalesce import Coalescer, compile_commands
+
+SPEC = [('template_mode',), ('template_init',), ('choose_template', '3'),
+        ('select_and_insert', 'name', 'Bob'), ('template_print',)]
+
+
+def test_failed_print_is_forgotten():
+    sent = []
+
+    def send(payload):
+        if not sent:
+            sent.append(None)
+            raise OSError('Printer offline.')
+        sent.append(payload)
+
+    coalescer = Coalescer(send=send, window=60)
+    try:
+        coalescer.print_job(SPEC)
+    except OSError:
+        pass
+    assert coalescer.print_job(SPEC) == 1
+    assert coalescer.print_job(SPEC) == 0
+    assert coalescer.print_job(SPEC, copies=2) == 2
+    assert len(sent) == 4
+
+
+def encode_concurrently(coalescer, count=8):
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = coalescer.encode(SPEC)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_encodes_compile_once():
+    gate = threading.Event()
+    calls = []
+
+    def slow_compile(spec):
+        calls.append(spec)
+        gate.wait(10)
+        return compile_commands(spec)
+
+    coalescer = Coalescer(compile=slow_compile)
+    threads, results = encode_concurrently(coalescer)
+    # Let every caller reach the encoding in flight before it finishes.
+    time.sleep(0.2)
+    gate.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    assert results[0][1] == compile_commands(SPEC)
+
+
+def test_compile_error_reaches_every_waiter():
+    gate = threading.Event()
+    calls = []
+
+    def failing_compile(spec):
+        calls.append(spec)
+        gate.wait(10)
+        raise RuntimeError('Unknown command.')
+
+    coalescer = Coalescer(compile=failing_compile)
+    threads, results = encode_concurrently(coalescer)
+    time.sleep(0.2)
+    gate.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == 'Unknown command.'
+               for result in results)
+    assert not coalescer._flights
@@ -0,0 +1,60 @@
+import numpy
+
+from brotherprint.composer import LabelComposer
+from brotherprint.decoder import decode
+
+
+def cut_settings(data):
+    return [(c.name, c.params['args']) for c in decode(data, 'raster')
+            if c.name in ('various_mode', 'cut_every', 'expanded_mode')]
+
+
+def label(height):
+    return numpy.ones((height, 200), dtype=numpy.bool_)
+
+
+def test_long_strip_cut_once_at_end():
+    composer = LabelComposer()
+    for _ in range(3):
+        composer.add(label(5000))
+    job = composer.compose()
+    assert len(job.pages) == 2
+    # No automatic cut between the pages, one cut after the last.
+    assert cut_settings(job.compile()) == [('various_mode', (0,)), ('expanded_mode', (0x08,))] * 2
+
+
+def test_cut_every_label():
+    composer = LabelComposer(cut='every')
+    composer.add(label(100), copies=3)
+    settings = cut_settings(composer.compile())
+    assert settings == [('various_mode', (0x40,)), ('cut_every', (1,)), ('expanded_mode', (0x08,))] * 3
+
+
+def test_chain_leaves_the_last_cut():
+    composer = LabelComposer(chain=True)
+    composer.add(label(100))
+    assert cut_settings(composer.compile()) == [('various_mode', (0,)), ('expanded_mode', (0,))]
+
+
+def test_job_options_override_cut_settings():
+    composer = LabelComposer(auto_cut=True, cut_at_end=False)
+    composer.add(label(100))
+    settings = cut_settings(composer.compile())
+    assert settings == [('various_mode', (0x40,)), ('cut_every', (1,)), ('expanded_mode', (0,))]
+
+
+def test_cut_every_group_split_across_pages():
+    composer = LabelComposer(cut='every', cut_every=3)
+    for _ in range(6):
+        composer.add(label(5000))
+    assert [[page.shape[0] for page in group] for group in composer.groups()] == [[10008, 5000]] * 2
+    modes = [args for name, args in cut_settings(composer.compile()) if name == 'various_mode']
+    # Only the last page of each group of three labels is cut.
+    assert modes == [(0,), (0x40,), (0,), (0x40,)]
+
+
+def test_chain_cut_every_leaves_the_last_cut():
+    composer = LabelComposer(cut='every', chain=True)
+    composer.add(label(100), copies=2)
+    modes = [args for name, args in cut_settings(composer.compile()) if name == 'various_mode']
+    assert modes == [(0x40,), (0,)]
@@ -0,0 +1,81 @@
+import time
+
+from brotherprint import BrotherPrint
+from brotherprint.decoder import Decoder, decode
+
+
+class Capture:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data.encode('latin-1') if isinstance(data, str) else data
+
+
+def label_stream():
+    buf = Capture()
+    job = BrotherPrint(buf)
+    job.command_mode()
+    job.initialize()
+    job.bold('on')
+    job.select_font('lettergothic')
+    job.char_size('33')
+    job.send('Hello')
+    job.forward_feed(20)
+    job.barcode('1234', 'code39')
+    job.print_page('full')
+    job.template_mode()
+    job.template_init()
+    job.choose_template('12')
+    job.select_and_insert('name', 'Bob')
+    job.template_print(3)
+    return bytes(buf.data)
+
+
+def test_brotherprint_output_round_trips():
+    data = label_stream()
+    commands = decode(data)
+    assert [(c.mode, c.name) for c in commands] == [
+        ('escp', 'mode'), ('escp', 'initialize'), ('escp', 'bold_on'),
+        ('escp', 'select_font'), ('escp', 'char_size'), ('escp', 'text'),
+        ('escp', 'forward_feed'), ('escp', 'barcode'), ('escp', 'cut_setting'),
+        ('escp', 'page_feed'), ('escp', 'mode'), ('template', 'template_init'),
+        ('template', 'choose_template'), ('template', 'select_obj'),
+        ('template', 'insert_into_obj'), ('template', 'copies'), ('template', 'template_print')]
+    # The commands cover the stream back to back.
+    assert b''.join(data[c.offset:c.offset + c.size] for c in commands) == data
+    assert sum(c.size for c in commands) == len(data)
+    by_name = dict((c.name, c) for c in commands)
+    assert by_name['text'].data == b'Hello'
+    assert by_name['forward_feed'].params == {'args': (20,)}
+    assert by_name['barcode'].data == b'1234'
+    assert by_name['select_obj'].params == {'name': 'name'}
+    assert by_name['insert_into_obj'].data == b'Bob'
+    assert by_name['copies'].params == {'args': (0, 0, 3)}
+
+
+def test_decoder_accepts_any_split():
+    data = label_stream()
+    expected = [(c.name, c.offset, c.size) for c in decode(data)]
+    for step in (1, 3, 7):
+        decoder = Decoder()
+        commands = []
+        for start in range(0, len(data), step):
+            commands += decoder.feed(data[start:start + step])
+        commands += decoder.close()
+        assert [(c.name, c.offset, c.size) for c in commands] == expected
+
+
+def test_long_text_run_fed_in_small_chunks():
+    data = b'\x1b@' + b'A' * 400000 + b'\x0c'
+    started = time.perf_counter()
+    decoder = Decoder()
+    commands = []
+    for start in range(0, len(data), 1024):
+        commands += decoder.feed(data[start:start + 1024])
+    commands += decoder.close()
+    # Linear in the stream length: a rescan per chunk takes seconds here.
+    assert time.perf_counter() - started < 0.5
+    assert commands == decode(data)
+    assert [c.name for c in commands] == ['initialize', 'text', 'page_feed']
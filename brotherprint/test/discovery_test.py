@@ -0,0 +1,74 @@
+from brotherprint.discovery import (connect_all, discover, parse_snmp_response, parse_status,
+                                    snmp_request)
+
+
+def status_reply(model=0x38, width=62):
+    data = bytearray(32)
+    data[0], data[1], data[4], data[10], data[11] = 0x80, 32, model, width, 0x0A
+    return bytes(data)
+
+
+class FakeBackend:
+    '''Every host accepts connections; only 10.0.0.2 answers status requests.
+
+    Over SNMP 10.0.0.2 names itself a QL printer, 10.0.0.3 another device, and the
+    other hosts stay silent.
+    '''
+
+    def __init__(self):
+        self.queried = []
+
+    def identify(self, address, timeout):
+        return {'10.0.0.2': 'Brother QL-800', '10.0.0.3': 'Brother HL-L2350DW'}.get(address[0])
+
+    def connect(self, address, timeout):
+        return address
+
+    def query(self, fsocket, timeout):
+        self.queried.append(fsocket)
+        return status_reply() if fsocket[0] == '10.0.0.2' else b''
+
+    def close(self, fsocket):
+        pass
+
+
+def test_parse_status():
+    status = parse_status(status_reply())
+    assert (status.model, status.media_width, status.media_type) == ('QL-800', 62, 'continuous')
+
+
+def test_snmp_request_and_response():
+    oid = '060b2b06010201190302010301'
+    assert snmp_request() == bytes.fromhex('302902010004067075626c6963a01c020101020100020100'
+                                           '3011300f' + oid + '0500')
+    reply = bytes.fromhex('303702010004067075626c6963a22a020101020100020100301f301d' + oid
+                          + '040e') + b'Brother QL-800'
+    assert parse_snmp_response(reply) == 'Brother QL-800'
+    no_such_name = bytes.fromhex('302902010004067075626c6963a21c020101020102020101'
+                                 '3011300f' + oid + '0500')
+    assert parse_snmp_response(no_such_name) is None
+    for invalid in (reply[:-3], reply[:2], b''):
+        try:
+            parse_snmp_response(invalid)
+        except RuntimeError as e:
+            assert str(e) == 'Invalid SNMP response.'
+        else:
+            raise AssertionError('truncated response accepted')
+
+
+def test_discover_queries_only_identified_ql_printers():
+    backend = FakeBackend()
+    found = discover('10.0.0.0/29', backend=backend)
+    assert [printer.address[0] for printer in found] == ['10.0.0.%d' % i for i in (1, 2, 4, 5, 6)]
+    assert [printer.status and printer.status.model for printer in found] == [None, 'QL-800', None,
+                                                                              None, None]
+    assert backend.queried == [('10.0.0.2', 9100)]
+
+
+def test_discover_probe_keeps_ql_printers():
+    backend = FakeBackend()
+    found = discover('10.0.0.0/29', backend=backend, probe=True)
+    assert [printer.address for printer in found] == [('10.0.0.2', 9100)]
+    assert found[0].status.model == 'QL-800'
+    assert len(backend.queried) == 6
+    assert [p.address for p in connect_all(['10.0.0.2'], backend=backend)] == [('10.0.0.2', 9100)]
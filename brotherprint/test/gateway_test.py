@@ -0,0 +1,145 @@
+import http.client
+import json
+
+from brotherprint.gateway import Gateway
+
+
+class Collector:
+    '''Stands in for a printer connection, keeping what is sent.'''
+
+    def __init__(self):
+        self.data = b''
+
+    def send(self, data):
+        self.data += data
+
+    def close(self):
+        pass
+
+
+class FlakyPrinter:
+    '''Refuses the first connections, then collects what is sent.'''
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.buf = Collector()
+
+    def connect(self, address):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('Printer offline.')
+        return self.buf
+
+
+def template_job(**extra):
+    spec = {'printer': 'p', 'type': 'template', 'template': 3, 'fields': {'name': 'Bob'}}
+    spec.update(extra)
+    return spec
+
+
+def test_duplicate_is_not_printed_twice():
+    printer = FlakyPrinter(0)
+    gateway = Gateway({'p': None}, address=('127.0.0.1', 0), window=0,
+                      connect=printer.connect, dedupe_window=60)
+    gateway.start()
+    try:
+        first = gateway.submit(template_job())
+        assert first.done.wait(5) and first.status == 'sent'
+        assert gateway.submit(template_job()).status == 'duplicate'
+        assert gateway.coalescer.suppressed == 1
+    finally:
+        gateway.stop()
+    assert printer.buf.data.count(b'^FF') == 1
+
+
+def test_failed_job_retry_is_printed():
+    printer = FlakyPrinter(1)
+    gateway = Gateway({'p': None}, address=('127.0.0.1', 0), window=0,
+                      connect=printer.connect, dedupe_window=60)
+    gateway.start()
+    try:
+        first = gateway.submit(template_job())
+        assert first.done.wait(5) and first.status == 'failed'
+        retry = gateway.submit(template_job())
+        assert retry.done.wait(5) and retry.status == 'sent'
+    finally:
+        gateway.stop()
+    assert printer.buf.data.count(b'^FF') == 1
+
+
+def post(address, body):
+    connection = http.client.HTTPConnection(*address, timeout=5)
+    try:
+        connection.request('POST', '/jobs', body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def test_bad_bodies_get_400():
+    printer = FlakyPrinter(0)
+    gateway = Gateway({'p': None}, address=('127.0.0.1', 0), window=0, connect=printer.connect)
+    address = gateway.start()
+    try:
+        cases = [(b'{', 'Invalid JSON.'),
+                 (b'[1, 2]', 'Invalid job.'),
+                 (template_job(fields={'a': 5}), 'Invalid field.'),
+                 (template_job(fields=[['a']]), 'Invalid field.'),
+                 (template_job(fields={'a': '€'}), 'Invalid field.'),
+                 (template_job(template='x'), 'Invalid template.'),
+                 (template_job(template=100), 'Invalid template.'),
+                 (template_job(wait=True, timeout='abc'), 'Invalid timeout.'),
+                 (template_job(copies='2'), 'Invalid copies.'),
+                 (template_job(printer=['p']), 'Unknown printer.'),
+                 ({'printer': 'p', 'type': 'raster', 'width': 8, 'height': 1, 'data': 'AA==',
+                   'media_width': 'x'}, 'Invalid job.')]
+        for body, error in cases:
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode('utf-8')
+            assert post(address, body) == (400, {'error': error})
+        status, job = post(address, json.dumps(template_job(wait=True, timeout=5)).encode('utf-8'))
+        assert status == 200 and job['status'] == 'sent'
+    finally:
+        gateway.stop()
+    # None of the rejected jobs reached the printer.
+    assert printer.buf.data.count(b'^FF') == 1
+
+
+def test_connect_errors_fail_the_batch_only():
+    attempts = []
+
+    def connect(address):
+        attempts.append(address)
+        if len(attempts) == 1:
+            raise RuntimeError('No route to printer.')
+        return Collector()
+
+    gateway = Gateway({'p': None}, address=('127.0.0.1', 0), window=0, connect=connect,
+                      dedupe_window=60)
+    gateway.start()
+    try:
+        first = gateway.submit(template_job())
+        assert first.done.wait(5)
+        assert (first.status, first.error) == ('failed', 'No route to printer.')
+        retry = gateway.submit(template_job())
+        assert retry.done.wait(5) and retry.status == 'sent'
+        assert gateway.batchers['p'].is_alive()
+    finally:
+        gateway.stop()
+
+
+def test_history_keeps_only_finished_jobs_bounded():
+    def connect(address):
+        raise RuntimeError('Printer stuck.')
+
+    gateway = Gateway({'p': None}, address=('127.0.0.1', 0), window=0, connect=connect,
+                      history=5)
+    gateway.start()
+    try:
+        jobs = [gateway.submit(template_job(fields={'n': str(i)})) for i in range(20)]
+        for job in jobs:
+            assert job.done.wait(5)
+    finally:
+        gateway.stop()
+    assert list(gateway.jobs) == [job.id for job in jobs[-5:]]
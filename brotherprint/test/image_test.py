@@ -0,0 +1,32 @@
+import numpy
+
+from brotherprint.image import dither, kernels, threshold
+
+
+def reference_dither(grey, method):
+    # Plain scan order error diffusion, one pixel at a time.
+    h, w = grey.shape
+    buf = numpy.array(grey, dtype=numpy.float32)
+    out = numpy.zeros((h, w), dtype=numpy.bool_)
+    for y in range(h):
+        for x in range(w):
+            old = buf[y, x]
+            out[y, x] = old < 128
+            error = old - (0 if old < 128 else 255)
+            for dy, dx, weight in kernels[method]:
+                if y + dy < h and 0 <= x + dx < w:
+                    buf[y + dy, x + dx] += numpy.float32(error * weight)
+    return out
+
+
+def test_dither_matches_per_pixel_reference():
+    noise = numpy.random.default_rng(0).random((40, 60)).astype(numpy.float32) * 255
+    gradient = numpy.tile(numpy.linspace(0, 255, 60, dtype=numpy.float32), (40, 1))
+    for grey in (noise, gradient, noise[:1], noise[:, :1]):
+        for method in kernels:
+            assert numpy.array_equal(dither(grey, method), reference_dither(grey, method))
+
+
+def test_threshold():
+    grey = numpy.array([[0, 127, 128, 255]], dtype=numpy.float32)
+    assert threshold(grey).tolist() == [[True, True, False, False]]
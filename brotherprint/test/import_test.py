@@ -0,0 +1,25 @@
+import subprocess
+import sys
+
+import pytest
+
+import brotherprint
+
+
+def test_core_import_skips_heavy_modules():
+    code = ('import sys, brotherprint\n'
+            'print(" ".join(m for m in ("numpy", "PIL", "re", "socket", "brotherprint.raster")\n'
+            '               if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == ''
+
+
+def test_lazy_names_resolve():
+    from brotherprint.raster import RasterJob
+    from brotherprint.transport import MemoryTransport
+    assert brotherprint.RasterJob is RasterJob
+    assert brotherprint.MemoryTransport is MemoryTransport
+    assert brotherprint.gateway.__name__ == 'brotherprint.gateway'
+    assert 'discover' in dir(brotherprint)
+    with pytest.raises(AttributeError):
+        brotherprint.missing
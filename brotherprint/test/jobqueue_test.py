@@ -0,0 +1,94 @@
+import numpy
+
+from brotherprint import BrotherPrint
+from brotherprint.decoder import decode
+from brotherprint.jobqueue import URGENT, BULK, PrintQueue, split_labels
+from brotherprint.raster import RasterJob
+from brotherprint.transport import MemoryTransport
+
+
+def template_labels(values, copies=None):
+    buf = MemoryTransport()
+    job = BrotherPrint(buf)
+    job.template_mode()
+    job.template_init()
+    for value in values:
+        job.choose_template('3')
+        job.select_and_insert('name', value)
+        job.template_print(copies)
+    return buf.getvalue()
+
+
+def test_labels_carry_their_own_copy_count():
+    header, labels = split_labels(template_labels(['a', 'b'], copies=3))
+    # The header resets the copy count a preempting label may have left behind.
+    assert header == b'\x1bia3^II^CN001'
+    assert len(labels) == 2
+    for label in labels:
+        names = [c.name for c in decode(label, 'template')]
+        assert names[-2:] == ['copies', 'template_print']
+        assert label.endswith(b'^CN003^FF')
+    header, labels = split_labels(template_labels(['a']))
+    assert labels[0].endswith(b'^TS003^ONname\x00^DI\x01\x00a^FF')
+
+
+def test_urgent_label_preempting_copies_prints_once():
+    bulk_header, bulk = split_labels(template_labels(['a', 'b', 'c'], copies=3))
+    urgent_header, urgent = split_labels(template_labels(['urgent']))
+    sent = []
+
+    def send(data):
+        if not sent:
+            queue.submit(urgent, priority=URGENT, header=urgent_header)
+        sent.append(data)
+
+    queue = PrintQueue(send, fairness='fifo')
+    ticket = queue.submit(bulk, priority=BULK, header=bulk_header)
+    queue.start()
+    assert ticket.done.wait(5)
+    queue.stop()
+    # The urgent label carries no count; its header sets one copy, and the bulk job
+    # resends its header when it resumes.
+    assert sent == [bulk_header, bulk[0], urgent_header, urgent[0], bulk_header, bulk[1], bulk[2]]
+
+
+def test_failing_label_generator_ends_its_job_only():
+    def labels():
+        yield b'^FF'
+        raise ValueError('bad label')
+
+    sent = []
+    queue = PrintQueue(sent.append, fairness='fair')
+    broken = queue.submit(labels(), submitter='a')
+    other = queue.submit([b'^FF'] * 3, submitter='b')
+    queue.start()
+    assert broken.done.wait(5) and other.done.wait(5)
+    queue.stop()
+    assert isinstance(broken.error, ValueError) and broken.sent == 1
+    assert other.error is None and other.sent == 3
+    assert len(sent) == 4
+
+
+def test_preempted_raster_job_reenters_raster_mode():
+    raster = RasterJob()
+    for _ in range(3):
+        raster.add_page(numpy.ones((10, 100), dtype=numpy.bool_))
+    raster_header, raster_labels = split_labels(raster.compile())
+    assert raster_header.endswith(b'\x1b@\x1bia\x01')
+    assert all(label.startswith(b'\x1biz') for label in raster_labels)
+    template_header, urgent = split_labels(template_labels(['urgent']))
+    sent = []
+
+    def send(data):
+        # The urgent job arrives while the first raster label is on its way.
+        if not sent:
+            queue.submit(urgent, priority=URGENT, header=template_header)
+        sent.append(data)
+
+    queue = PrintQueue(send, fairness='fifo')
+    ticket = queue.submit(raster_labels, priority=BULK, header=raster_header)
+    queue.start()
+    assert ticket.done.wait(5)
+    queue.stop()
+    assert sent == [raster_header, raster_labels[0], template_header, urgent[0],
+                    raster_header, raster_labels[1], raster_labels[2]]
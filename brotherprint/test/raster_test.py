@@ -0,0 +1,115 @@
+import numpy
+
+from brotherprint.decoder import decode
+from brotherprint.image import split_colors
+from brotherprint.raster import RasterJob, pack_page, pack_two_color_page, packbits
+from brotherprint.stream import MemmapSource, TiledSource
+
+
+def unpackbits(data):
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        header = data[pos]
+        if header < 128:
+            out += data[pos + 1:pos + 2 + header]
+            pos += 2 + header
+        else:
+            out += data[pos + 1:pos + 2] * (257 - header)
+            pos += 2
+    return bytes(out)
+
+
+def raster_pages(data):
+    '''Rebuild the packed pages of a compiled monochrome job.'''
+    pages = []
+    lines = []
+    compress = False
+    for command in decode(data, 'raster'):
+        if command.name == 'compression':
+            compress = command.params['args'] == (2,)
+        elif command.name == 'raster_line':
+            lines.append(unpackbits(command.data) if compress else command.data)
+        elif command.name == 'zero_line':
+            lines.append(None)
+        elif command.name in ('print', 'print_feed'):
+            width = max(len(line) for line in lines if line is not None)
+            pages.append(numpy.array([list(line or bytes(width)) for line in lines],
+                                     dtype=numpy.uint8))
+            lines = []
+    return pages
+
+
+def test_packbits_round_trip():
+    rng = numpy.random.default_rng(0)
+    cases = [b'', b'\x00', b'\x01\x02', b'\xff' * 3, b'\xff' * 128, b'\xff' * 129,
+             b'\xff' * 130, b'\xff' * 300, bytes(range(256)), b'ab' + b'\x00' * 200 + b'cd',
+             rng.integers(0, 256, 1000, dtype=numpy.uint8).tobytes(),
+             rng.integers(0, 2, 1000, dtype=numpy.uint8).tobytes()]
+    for data in cases:
+        assert unpackbits(packbits(data)) == data
+
+
+def test_compiled_job_decodes_to_its_pages():
+    rng = numpy.random.default_rng(1)
+    image = rng.random((50, 400)) > 0.7
+    image[10:20] = False
+    for compress in (True, False):
+        job = RasterJob(compress=compress)
+        job.add_page(image)
+        job.add_page(image[::-1])
+        data = job.compile()
+        assert not [c for c in decode(data, 'raster') if c.name == 'unknown']
+        pages = raster_pages(data)
+        assert len(pages) == 2
+        for page, packed in zip(pages, job.pages):
+            assert numpy.array_equal(page, packed)
+
+
+def test_two_color_job_decodes_to_both_planes():
+    rgb = numpy.full((60, 300, 3), 255, dtype=numpy.uint8)
+    rgb[5:20, 10:100] = (0, 0, 0)
+    rgb[25:40, 50:250] = (220, 20, 30)
+    rgb[45:55, 0:300] = (100, 100, 100)
+    rgb[45:55, 150:160] = (200, 150, 150)
+    black, red = split_colors(rgb)
+    assert black[5:20, 10:100].all() and black[45:55, :150].all()
+    assert red[25:40, 50:250].all() and red.sum() == 15 * 200
+    # Pale red is not saturated enough for red, nor dark enough for black.
+    assert not black[45:55, 150:160].any() and not red[45:55, 150:160].any()
+    assert not (black & red).any()
+
+    for compress in (True, False):
+        job = RasterJob(two_color=True, compress=compress)
+        job.add_page(rgb)
+        data = job.compile()
+        commands = decode(data, 'raster')
+        expanded, = [c.params['args'] for c in commands if c.name == 'expanded_mode']
+        assert expanded[0] & 0x01
+        lines = [c for c in commands if c.name == 'raster_line']
+        # One 'w' line per plane, black then red, for every raster line.
+        assert [c.params['color'] for c in lines] == [0x01, 0x02] * 60
+        planes = numpy.array([list(unpackbits(c.data) if compress else c.data) for c in lines],
+                             dtype=numpy.uint8).reshape(60, 2, -1)
+        assert numpy.array_equal(planes, job.pages[0])
+        margin = job.right_margin
+        expected = numpy.stack((pack_page(black, right_margin=margin),
+                                pack_page(red, right_margin=margin)), axis=1)
+        assert numpy.array_equal(planes, expected)
+        assert numpy.array_equal(pack_two_color_page((black, red), right_margin=margin), expected)
+
+
+def test_stream_matches_compile(tmp_path):
+    rng = numpy.random.default_rng(2)
+    image = rng.random((700, 500)) > 0.6
+    image[100:300] = False
+    path = tmp_path / 'label.raw'
+    numpy.packbits(image, axis=1).tofile(str(path))
+    for compress in (True, False):
+        job = RasterJob(compress=compress)
+        job.add_page(image)
+        expected = job.compile()
+        memmap = MemmapSource(str(path), 500, 700, rows=64)
+        tiles = TiledSource(lambda index: image[index * 300:(index + 1) * 300], 700, 300)
+        for source in (memmap, tiles):
+            assert b''.join(RasterJob(compress=compress).stream(source)) == expected
@@ -0,0 +1,39 @@
+from socketserver import ThreadingTCPServer
+
+from brotherprint import BrotherPrint
+from brotherprint.replay import MAGIC, RECORD, FLUSH, Emulator, Recorder, read_log, replay
+
+
+def record_labels(path, count):
+    recorder = Recorder(str(path))
+    for printer in ('shipping', 'returns'):
+        job = BrotherPrint(recorder.transport(printer))
+        for i in range(count):
+            job.choose_template('3')
+            job.select_and_insert('name', 'label %d' % i)
+            job.template_print()
+            job.flush()
+    recorder.close()
+
+
+def test_log_holds_one_record_per_label(tmp_path):
+    path = tmp_path / 'traffic.log'
+    record_labels(path, 10)
+    records = list(read_log(str(path)))
+    assert [record.kind for record in records] == [FLUSH] * 20
+    payload = sum(len(record.data) for record in records)
+    names = len('shipping') + len('returns')
+    assert path.stat().st_size == len(MAGIC) + RECORD.size * 22 + names + payload
+
+
+def test_replay_to_emulator(tmp_path):
+    path = tmp_path / 'traffic.log'
+    record_labels(path, 10)
+    payload = sum(len(record.data) for record in read_log(str(path)))
+    emulator = Emulator()
+    try:
+        report = replay(str(path), emulator.start(), speed=0)
+    finally:
+        emulator.stop()
+    assert (report.labels, report.bytes, report.errors) == (20, payload, 0)
+    assert not ThreadingTCPServer.allow_reuse_address
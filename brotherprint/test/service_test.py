@@ -0,0 +1,121 @@
+import time
+
+import numpy
+
+from brotherprint.replay import Emulator
+from brotherprint.service import JOB, RingBuffer, Service
+from brotherprint.transport import connect_socket
+
+
+class BrokenTransport:
+
+    def send(self, data):
+        raise TypeError('broken transport')
+
+    def close(self):
+        pass
+
+
+def connect_broken(address):
+    return BrokenTransport()
+
+
+def connect_stuck(address):
+    time.sleep(60)
+
+
+def test_ring_buffer_wraps_records():
+    ring = RingBuffer(capacity=64)
+    try:
+        for i in range(50):
+            record = bytes([i]) * (i % 30 + 1)
+            ring.put(record[:3], record[3:])
+            assert ring.get(1) == record
+        assert ring.get(0.01) is None
+    finally:
+        ring.close()
+
+
+def test_ring_buffer_put_times_out():
+    ring = RingBuffer(capacity=64)
+    try:
+        ring.put(b'x' * 60)
+        started = time.monotonic()
+        try:
+            ring.put(b'y', timeout=0.3)
+        except RuntimeError as e:
+            assert str(e) == 'Timed out waiting for space.'
+        else:
+            raise AssertionError('put into a full ring buffer succeeded')
+        assert time.monotonic() - started < 2
+    finally:
+        ring.close()
+
+
+def test_jobs_reach_the_printers():
+    emulator = Emulator()
+    address = emulator.start()
+    service = Service(dict(('p%d' % i, address) for i in range(4)), workers=2, capacity=16384)
+    service.start()
+    try:
+        jobs = [service.submit('p%d' % (i % 4), b'x' * (i * 37 % 900 + 1)) for i in range(100)]
+        rows = numpy.packbits(numpy.ones((20, 100), dtype=numpy.bool_), axis=1).tobytes()
+        raster = service.submit_raster('p1', rows, 100, 20)
+        for job in jobs + [raster]:
+            assert service.wait(job, 10)['status'] == 'sent'
+    finally:
+        service.stop(5)
+    status = service.status()
+    assert sum(m['jobs'] for m in status.values()) == 101
+    sent = sum(m['bytes'] for m in status.values())
+    deadline = time.time() + 5
+    while emulator.bytes_received < sent and time.time() < deadline:
+        time.sleep(0.01)
+    assert emulator.bytes_received == sent
+    emulator.stop()
+
+
+def test_transport_errors_fail_the_job_only():
+    service = Service({'p': ('127.0.0.1', 1)}, connect=connect_broken)
+    service.start()
+    try:
+        for _ in range(2):
+            job = service.wait(service.submit('p', b'x'), 10)
+            assert job['status'] == 'failed'
+            assert job['error'] == 'broken transport'
+        assert service.processes[0].is_alive()
+    finally:
+        service.stop(5)
+
+
+def test_dead_worker_fails_its_jobs():
+    service = Service({'p': ('127.0.0.1', 1)}, capacity=1024, connect=connect_socket)
+    service.start()
+    try:
+        service.processes[0].kill()
+        service.processes[0].join()
+        deadline = time.time() + 10
+        while service.status()['p']['status'] != 'The worker stopped.' and time.time() < deadline:
+            time.sleep(0.05)
+        assert service.status()['p']['status'] == 'The worker stopped.'
+        try:
+            service.submit('p', b'x')
+        except RuntimeError as e:
+            assert str(e) == 'The worker stopped.'
+        else:
+            raise AssertionError('submit to a dead worker succeeded')
+    finally:
+        service.stop(5)
+
+
+def test_stop_terminates_a_stuck_worker():
+    service = Service({'p': ('127.0.0.1', 1)}, capacity=1024, connect=connect_stuck)
+    service.start()
+    process = service.processes[0]
+    service.submit('p', b'x')
+    # Fills the ring once the worker has taken the first job, leaving no room to stop.
+    service.submit('p', b'x' * (1024 - 4 - JOB.size - 1 - 2))
+    started = time.monotonic()
+    service.stop(1)
+    assert time.monotonic() - started < 10
+    assert not process.is_alive()
@@ -0,0 +1,195 @@
+import os
+import socket
+
+import numpy
+
+from brotherprint import BrotherPrint
+from brotherprint.decoder import decode
+from brotherprint.raster import RasterJob
+from brotherprint.replay import Emulator
+from brotherprint.transport import BLOCK_SIZE, DeviceTransport, MemoryTransport, SocketTransport
+
+
+def limited_link(rate, buffer_size=65536):
+    emulator = Emulator(rate=rate, buffer_size=buffer_size)
+    address = emulator.start()
+    fsocket = socket.socket()
+    fsocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+    fsocket.connect(address)
+    return emulator, SocketTransport(fsocket)
+
+
+def text_page():
+    page = numpy.zeros((300, 696), dtype=numpy.bool_)
+    page[100:140, 50:400] = True
+    return page
+
+
+def compression(data):
+    return [c.params for c in decode(data, 'raster') if c.name == 'compression']
+
+
+def test_memory_transport_collects_str_and_bytes():
+    buf = MemoryTransport()
+    buf.send('^FF')
+    buf.send(b'\x1b@')
+    assert buf.getvalue() == b'^FF\x1b@'
+    assert buf.bytes_sent == 5
+
+
+class ShortSocket:
+    '''A socket whose sendmsg takes at most limit bytes per call.'''
+
+    def __init__(self, limit=7):
+        self.limit = limit
+        self.data = bytearray()
+        self.calls = []
+
+    def sendmsg(self, buffers):
+        self.calls.append([len(buffer) for buffer in buffers])
+        taken = bytes(b''.join(bytes(buffer) for buffer in buffers))[:self.limit]
+        self.data += taken
+        return len(taken)
+
+
+class PlainSocket:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def sendall(self, data):
+        self.data += data
+
+
+def pieces(count=300):
+    return [bytes([i % 251]) * (i % 23 + 1) for i in range(count)]
+
+
+def test_socket_partial_writes_are_completed():
+    fsocket = ShortSocket()
+    transport = SocketTransport(fsocket, buffer_size=BLOCK_SIZE)
+    for piece in pieces(1000):
+        transport.send(piece)
+    # Only whole blocks are written before the flush.
+    assert len(fsocket.data) and len(fsocket.data) % BLOCK_SIZE == 0
+    transport.flush()
+    assert bytes(fsocket.data) == b''.join(pieces(1000))
+    assert transport.bytes_sent == len(fsocket.data)
+    # Many queued sends go out in one scatter/gather call.
+    assert max(len(call) for call in fsocket.calls) > 1
+
+
+def test_socket_without_sendmsg():
+    fsocket = PlainSocket()
+    transport = SocketTransport(fsocket, buffer_size=100)
+    sizes = []
+    for piece in pieces():
+        transport.send(piece)
+        sizes.append(len(fsocket.data))
+    # Small buffers write as soon as they fill, unaligned.
+    assert 0 < sizes[20] < BLOCK_SIZE
+    transport.flush()
+    assert bytes(fsocket.data) == b''.join(pieces())
+
+
+def test_reused_buffer_is_copied():
+    fsocket = PlainSocket()
+    transport = SocketTransport(fsocket)
+    buf = bytearray(b'first')
+    transport.send(buf)
+    buf[:] = b'WRONG'
+    transport.send(memoryview(b'second'))
+    transport.flush()
+    assert bytes(fsocket.data) == b'firstsecond'
+
+
+def test_device_transport_writes_a_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'lp0')
+    writev = os.writev
+    sizes = []
+
+    def short_writev(fd, buffers):
+        # Write at most 5 bytes, as a device with a small buffer may.
+        sizes.append(sum(len(buffer) for buffer in buffers))
+        return writev(fd, [bytes(b''.join(bytes(buffer) for buffer in buffers))[:5]])
+
+    monkeypatch.setattr(os, 'writev', short_writev)
+    transport = DeviceTransport(path, buffer_size=BLOCK_SIZE)
+    for piece in pieces(1000):
+        transport.send(piece)
+    transport.close()
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(pieces(1000))
+    assert sizes[0] % BLOCK_SIZE == 0
+
+    transport = DeviceTransport(path, append=True)
+    transport.send('^FF')
+    transport.close()
+    transport.close()
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(pieces(1000)) + b'^FF'
+
+
+def test_device_transport_without_writev(tmp_path, monkeypatch):
+    path = str(tmp_path / 'capture.bin')
+    write = os.write
+    monkeypatch.delattr(os, 'writev')
+    monkeypatch.setattr(os, 'write', lambda fd, data: write(fd, bytes(data)[:3]))
+    transport = DeviceTransport(path, buffer_size=0)
+    for piece in pieces(50):
+        transport.send(piece)
+    transport.close()
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(pieces(50))
+
+
+def test_throughput_unknown_while_buffers_absorb_writes():
+    # Small jobs never fill the socket buffers, so their write timing is not a rate.
+    emulator, transport = limited_link(200000, buffer_size=1 << 20)
+    try:
+        for _ in range(20):
+            transport.send(b'\x55' * 4096)
+        transport.flush()
+        assert transport.throughput is None
+    finally:
+        transport.close()
+        emulator.stop()
+
+
+def test_throughput_measures_rate_limited_link():
+    rate = 1000000
+    emulator, transport = limited_link(rate)
+    try:
+        for _ in range(int(rate * 1.5) // 4096):
+            transport.send(b'\x55' * 4096)
+        transport.flush()
+        assert transport.throughput is not None
+        assert 0.5 * rate < transport.throughput < 1.5 * rate
+    finally:
+        transport.close()
+        emulator.stop()
+
+
+def test_auto_compression_without_measured_rate():
+    emulator, transport = limited_link(200000, buffer_size=1 << 20)
+    try:
+        raster = RasterJob(compress='auto')
+        raster.add_page(text_page())
+        BrotherPrint(transport).print_raster(raster)
+        # No trustworthy rate yet: compression is chosen because it saves bytes.
+        assert transport.throughput is None
+        assert compression(raster.compile(link_rate=transport.throughput)) == [{'args': (2,)}]
+    finally:
+        transport.close()
+        emulator.stop()
+
+
+def test_auto_compression_trades_cpu_for_bytes():
+    raster = RasterJob(compress='auto')
+    raster.add_page(text_page())
+    assert raster.choose_compression(raster.pages[0], link_rate=200000)
+    assert not raster.choose_compression(raster.pages[0], link_rate=1e15)
+    noise = numpy.random.default_rng(0).random((300, 696)) > 0.5
+    dense = RasterJob(compress='auto')
+    dense.add_page(noise)
+    assert compression(dense.compile()) == [{'args': (0,)}]
@@ -0,0 +1,314 @@
+'''Transports
+
+Description:
+Where BrotherPrint output goes: a network socket, a character device such as a USB
+attached printer's /dev/usb/lp0 (or a plain file, to capture jobs), or memory.
+
+BrotherPrint sends many small commands. Transports collect them and write in large
+chunks aligned to the block size, with a single scatter/gather call (os.writev or
+socket.sendmsg) where the platform has one, looping until partial writes are complete.
+Whatever is still buffered is written by flush(), which BrotherPrint calls at the end
+of every label.
+
+Transports also estimate the link speed, which raster jobs use to decide whether
+compression pays off. A write returning only means the data reached the kernel or
+device buffers, so the rate is measured only while the link is the bottleneck: from the
+first write that blocks (the buffers are full) over a window of back to back writes,
+during which the bytes accepted match the bytes leaving. Until then throughput is None.
+'''
+import io
+import os
+import sys
+import time
+
+
+BLOCK_SIZE = 4096
+IOV_MAX = 1024
+
+# A write taking longer than this waited for buffer space rather than copying data.
+BLOCKED_WRITE = 0.001
+# A pause between writes longer than this lets the buffers drain, ending a measurement.
+IDLE_GAP = 0.01
+# Shortest measurement window, in seconds and in bytes.
+RATE_WINDOW = 0.25
+RATE_SAMPLE_SIZE = 16384
+# Weight of the newest sample in the throughput moving average.
+RATE_WEIGHT = 0.2
+
+
+def _advance(buffers, written):
+    # Drop what a partial scatter/gather write took from the front of buffers.
+    while written:
+        if written >= len(buffers[0]):
+            written -= len(buffers[0])
+            buffers.pop(0)
+        else:
+            buffers[0] = buffers[0][written:]
+            written = 0
+
+
+class Transport:
+    '''Base class: buffers sends and writes them in aligned chunks.
+
+    Attributes:
+        buffer_size: bytes collected before writing. 0 writes every send through.
+        bytes_sent: total bytes written.
+        throughput: exponentially weighted moving average of the link speed in bytes
+        per second, None until it has been measured with the buffers full.
+    '''
+
+    def __init__(self, buffer_size=65536):
+        self.buffer_size = buffer_size
+        self.bytes_sent = 0
+        self.throughput = None
+        self._rate_start = None
+        self._rate_bytes = 0
+        self._last_write = None
+        self._pending = []
+        self._pending_size = 0
+
+    def send(self, data):
+        '''Queue data for the printer, writing once enough has been collected.
+
+        Args:
+            data: bytes, a bytes-like object, which is copied, or a str of byte values
+            as built by BrotherPrint.
+        Returns:
+            None
+        Raises:
+            OSError: The write failed.
+        '''
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        elif not isinstance(data, bytes):
+            # A bytearray or buffer may be reused by the caller before it is written.
+            data = bytes(data)
+        if not data:
+            return
+        self._pending.append(memoryview(data))
+        self._pending_size += len(data)
+        if self._pending_size >= self.buffer_size:
+            size = self._pending_size
+            if self.buffer_size >= BLOCK_SIZE:
+                size -= size % BLOCK_SIZE
+            self._flush(size)
+
+    def flush(self):
+        '''Write everything still buffered.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            OSError: The write failed.
+        '''
+        if self._pending_size:
+            self._flush(self._pending_size)
+
+    def _flush(self, size):
+        buffers = []
+        while size:
+            first = self._pending[0]
+            if len(first) <= size:
+                buffers.append(self._pending.pop(0))
+                size -= len(first)
+            else:
+                buffers.append(first[:size])
+                self._pending[0] = first[size:]
+                size = 0
+        written = sum(len(buffer) for buffer in buffers)
+        self._pending_size -= written
+        started = time.perf_counter()
+        self._write(buffers)
+        ended = time.perf_counter()
+        self.bytes_sent += written
+        self._measure(written, started, ended)
+
+    def _measure(self, written, started, ended):
+        if self._last_write is not None and started - self._last_write > IDLE_GAP:
+            self._rate_start = None
+        self._last_write = ended
+        if self._rate_start is None:
+            if ended - started > BLOCKED_WRITE:
+                self._rate_start = ended
+                self._rate_bytes = 0
+            return
+        self._rate_bytes += written
+        elapsed = ended - self._rate_start
+        if elapsed < RATE_WINDOW or self._rate_bytes < RATE_SAMPLE_SIZE:
+            return
+        rate = self._rate_bytes / elapsed
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput += RATE_WEIGHT * (rate - self.throughput)
+        self._rate_start = ended
+        self._rate_bytes = 0
+
+    def _write(self, buffers):
+        raise NotImplementedError
+
+    def close(self):
+        '''Flush and release the underlying connection or file.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            OSError: The final write failed.
+        '''
+        self.flush()
+
+
+class SocketTransport(Transport):
+    '''A connected stream socket.
+
+    Attributes:
+        fsocket: the socket.
+    '''
+
+    def __init__(self, fsocket, buffer_size=65536):
+        Transport.__init__(self, buffer_size)
+        self.fsocket = fsocket
+
+    @classmethod
+    def connect(cls, host, port=9100, timeout=None, buffer_size=65536):
+        '''Open a TCP connection to a printer.
+
+        Args:
+            host: printer host name or address.
+            port: raw printing port.
+            timeout: connect timeout in seconds.
+            buffer_size: see Transport.
+        Returns:
+            A SocketTransport.
+        Raises:
+            socket.error: The printer is unreachable.
+        '''
+        import socket
+        fsocket = socket.create_connection((host, port), timeout)
+        fsocket.settimeout(None)
+        return cls(fsocket, buffer_size)
+
+    def _write(self, buffers):
+        if not hasattr(self.fsocket, 'sendmsg'):
+            self.fsocket.sendall(b''.join(buffers))
+            return
+        while buffers:
+            _advance(buffers, self.fsocket.sendmsg(buffers[:IOV_MAX]))
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.fsocket.close()
+
+
+class DeviceTransport(Transport):
+    '''A character device, e.g. /dev/usb/lp0, or a file capturing the output.
+
+    Attributes:
+        path: the device or file name.
+    '''
+
+    def __init__(self, path, append=False, buffer_size=65536):
+        '''Open the device or file.
+
+        Args:
+            path: the device or file name. Files are created if missing.
+            append: keep existing file contents instead of truncating.
+            buffer_size: see Transport.
+        Raises:
+            OSError: The device or file could not be opened.
+        '''
+        Transport.__init__(self, buffer_size)
+        self.path = path
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+        self.fd = os.open(path, flags, 0o644)
+
+    def _write(self, buffers):
+        if not hasattr(os, 'writev'):
+            for buffer in buffers:
+                while buffer:
+                    buffer = buffer[os.write(self.fd, buffer):]
+            return
+        while buffers:
+            _advance(buffers, os.writev(self.fd, buffers[:IOV_MAX]))
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+class MemoryTransport(Transport):
+    '''Collects the output in memory, for tests, benchmarks and compiling jobs.'''
+
+    def __init__(self):
+        Transport.__init__(self, buffer_size=0)
+        self.data = io.BytesIO()
+
+    def _write(self, buffers):
+        for buffer in buffers:
+            self.data.write(buffer)
+
+    def getvalue(self):
+        '''Everything sent so far.
+
+        Args:
+            None
+        Returns:
+            bytes
+        Raises:
+            None
+        '''
+        return self.data.getvalue()
+
+    def clear(self):
+        '''Forget everything sent so far.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        '''
+        self.data = io.BytesIO()
+
+
+def as_transport(fsocket):
+    '''Wrap what was passed to BrotherPrint in a transport.
+
+    Args:
+        fsocket: a Transport, a connected socket, or any object with a send method.
+    Returns:
+        The Transport itself, a write-through SocketTransport for sockets, and other
+        objects unchanged.
+    Raises:
+        None
+    '''
+    # Only look socket up if something already imported it; the core import skips it.
+    socket = sys.modules.get('socket')
+    if socket is not None and isinstance(fsocket, socket.socket):
+        return SocketTransport(fsocket, buffer_size=0)
+    return fsocket
+
+
+def connect_socket(address):
+    '''Default connection factory of the gateway, service and replay tools.
+
+    Args:
+        address: (host, port) tuple.
+    Returns:
+        A write-through SocketTransport.
+    Raises:
+        socket.error: The printer is unreachable.
+    '''
+    return SocketTransport.connect(address[0], address[1], timeout=5, buffer_size=0)
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='brotherprint',
@@ -10,4 +10,11 @@ setup(
     license='LICENSE.txt',
     description='Wrapper for Brother networked label printing commands.',
     long_description=open('README').read(),
+    extras_require={
+        'image': ['numpy', 'Pillow'],
+        'qrcode': ['numpy', 'qrcode'],
+        'pdf417': ['numpy', 'pdf417gen'],
+        'datamatrix': ['numpy', 'pylibdmtx'],
+        'all': ['numpy', 'Pillow', 'qrcode', 'pdf417gen', 'pylibdmtx'],
+    },
 )